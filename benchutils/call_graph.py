@@ -1,16 +1,180 @@
-from pycallgraph import PyCallGraph
-from pycallgraph.output import GraphvizOutput
-from pycallgraph import Config
-from pycallgraph import GlobbingFilter
+import os
+import sys
+import time
+import threading
+
+from typing import Dict, List, Tuple
 
 NO_CALL_GRAPHS = True
 
 
-def make_callgraph(name: str, id: str, dry_run=NO_CALL_GRAPHS) -> 'PyCallGraph':
+class _Node:
+    __slots__ = ('count', 'self_count', 'children')
+
+    def __init__(self):
+        self.count = 0
+        self.self_count = 0
+        self.children: Dict[object, '_Node'] = {}
+
+
+def _label(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return '{}:{}:{}'.format(module, code.co_name, code.co_firstlineno)
+
+
+class SamplingProfiler:
+    """
+        Statistical profiler, a background thread samples the stack of every other thread
+        (`sys._current_frames()`) every `interval` seconds and aggregates them inside a trie keyed by code object.
+
+        Nothing is traced, the profiled threads only pay for the GIL switches to the sampler thread
+        (a few percent at the default 200Hz). On exit the collapsed stacks (flamegraph.pl/speedscope format)
+        and a call graph summary are written to `<output_dir>/<name>_<id>.collapsed|.txt`
+    """
+
+    def __init__(self, name: str, id: str, interval=0.005, output_dir='call_graphs', threads=None):
+        self.name = name
+        self.id = id
+        self.interval = interval
+        self.output_dir = output_dir
+        self.threads = threads
+        self.root = _Node()
+        self.labels: Dict[object, str] = {}
+        self.samples = 0
+        self.elapsed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = 0
+
+    def sample(self, frames=None):
+        """ add the current stack of every profiled thread to the trie """
+        frames = frames if frames is not None else sys._current_frames()
+        own = threading.get_ident()
+
+        for ident, frame in frames.items():
+            if ident == own or (self.threads is not None and ident not in self.threads):
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+
+            node = self.root
+            node.count += 1
+            for code in reversed(stack):
+                child = node.children.get(code)
+                if child is None:
+                    child = node.children[code] = _Node()
+                    if code not in self.labels:
+                        self.labels[code] = _label(code)
+
+                child.count += 1
+                node = child
+
+            node.self_count += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._stop.clear()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='benchutils-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed += time.perf_counter() - self._start
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        self.save()
+
+    def _paths(self):
+        """ (labels from the root, node) of every node of the trie, iterative so deep stacks do not recurse """
+        pending = [((), self.root)]
+
+        while pending:
+            path, node = pending.pop()
+            if path:
+                yield path, node
+
+            for code, child in node.children.items():
+                pending.append((path + (self.labels[code],), child))
+
+    def collapsed(self) -> List[Tuple[str, int]]:
+        """ ('root;caller;callee', self samples) for every stack that was sampled """
+        return [(';'.join(path), node.self_count) for path, node in self._paths() if node.self_count]
+
+    def functions(self) -> Dict[str, List[int]]:
+        """ function -> [total samples, self samples], recursive calls are only counted once per stack """
+        stats = {}
+
+        for path, node in self._paths():
+            entry = stats.setdefault(path[-1], [0, 0])
+            entry[1] += node.self_count
+
+            if path[-1] not in path[:-1]:
+                entry[0] += node.count
+
+        return stats
+
+    def edges(self) -> Dict[Tuple[str, str], int]:
+        """ (caller, callee) -> number of samples where caller was calling callee, once per stack """
+        edges = {}
+
+        for path, node in self._paths():
+            if len(path) < 2:
+                continue
+
+            edge = path[-2:]
+            if edge not in set(zip(path[:-2], path[1:-1])):
+                edges[edge] = edges.get(edge, 0) + node.count
+
+        return edges
+
+    def summary(self, top=30) -> str:
+        total = max(self.samples, 1)
+        lines = ['{} samples in {:.3f}s (every {:.1f}ms)'.format(self.samples, self.elapsed, self.interval * 1000), '']
+
+        lines.append('{:>8} {:>8}  {}'.format('total%', 'self%', 'function'))
+        functions = sorted(self.functions().items(), key=lambda item: item[1][0], reverse=True)
+        for label, (count, self_count) in functions[:top]:
+            lines.append('{:8.2f} {:8.2f}  {}'.format(count * 100 / total, self_count * 100 / total, label))
+
+        lines.extend(['', '{:>8}  {}'.format('calls%', 'caller -> callee')])
+        edges = sorted(self.edges().items(), key=lambda item: item[1], reverse=True)
+        for (caller, callee), count in edges[:top]:
+            lines.append('{:8.2f}  {} -> {}'.format(count * 100 / total, caller, callee))
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, '{}_{}'.format(self.name, self.id))
+
+        with open(base + '.collapsed', 'w') as file:
+            for stack, count in self.collapsed():
+                file.write('{} {}\n'.format(stack, count))
+
+        with open(base + '.txt', 'w') as file:
+            file.write(self.summary())
+
+
+def make_callgraph(name: str, id: str, dry_run=NO_CALL_GRAPHS, interval=0.005) -> 'SamplingProfiler':
     """
     :param name: file name used to generate the call graph
     :param id:  if of the image
     :param dry_run: if True do not generate a call graph
+    :param interval: sampling interval in seconds
     :return: a context manager
     """
     class DummyCtx:
@@ -23,12 +187,4 @@ def make_callgraph(name: str, id: str, dry_run=NO_CALL_GRAPHS) -> 'PyCallGraph':
     if dry_run:
         return DummyCtx()
 
-    config = Config()
-    config.trace_filter = GlobbingFilter(exclude=[
-        'pycallgraph.*',
-        'tornado*',
-        '*SynchronizedStatStreamStruct*'
-    ])
-    output = GraphvizOutput(output_file='call_graphs/{}_{}.png'.format(name, id))
-    return PyCallGraph(output=output, config=config)
-
+    return SamplingProfiler(name, id, interval=interval)
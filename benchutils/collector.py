@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from typing import Dict, List, Tuple, Union
+
+from benchutils.chrono import MultiStageChrono
+from benchutils.statstream import StatStream
+
+log = logging.getLogger(__name__)
+
+Address = Union[Tuple[str, int], str]
+
+# keep the datagrams under the UDP limit (65507 bytes)
+MAX_DATAGRAM = 60000
+
+
+def _make_socket(address: Address) -> socket.socket:
+    """ UDP socket for (host, port) addresses, Unix datagram socket for paths """
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+def _pack(node: str, seq: int, stages: Dict[str, Dict]) -> List[bytes]:
+    """ split the stage deltas into datagrams smaller than MAX_DATAGRAM """
+    messages = []
+    batch = []
+    size = 0
+
+    for name, delta in stages.items():
+        encoded = json.dumps(name) + ':' + json.dumps(delta)
+
+        if batch and size + len(encoded) > MAX_DATAGRAM:
+            messages.append(batch)
+            batch, size = [], 0
+
+        batch.append(encoded)
+        size += len(encoded) + 1
+
+    if batch:
+        messages.append(batch)
+
+    header = '{{"node": {}, "seq": {}, "stages": {{'.format(json.dumps(node), seq)
+    return [(header + ','.join(batch) + '}}').encode('utf-8') for batch in messages]
+
+
+class CollectorClient:
+    """
+        Client side of the collector, time the stages using `client.chrono` as usual.
+
+        A background thread takes the delta of every stage (`StatStream.pop_state_dict`) every `interval` seconds
+        and sends them to the collector, the timed code only pays for the usual `StatStream.update`.
+        Deltas are sent over UDP (or a Unix datagram socket if `address` is a path), a lost datagram loses the
+        observations it contained.
+
+        Sharded and pooled streams cannot be reset, `shards` and `pool` are not supported.
+    """
+
+    def __init__(self, address: Address = ('127.0.0.1', 9876), interval=1.0, node=None, skip_obs=10,
+                 sketch=False, **kwargs):
+        for option in ('shards', 'pool'):
+            if kwargs.get(option):
+                raise ValueError('CollectorClient does not support `{}`, deltas are taken by resetting '
+                                 'the streams'.format(option))
+
+        self.address = address
+        self.interval = interval
+        self.node = node or '{}:{}'.format(socket.gethostname(), threading.get_native_id())
+        self.chrono = MultiStageChrono(skip_obs, sketch=sketch, **kwargs)
+        self.socket = _make_socket(address)
+        self.seq = 0
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='benchutils-collector-client', daemon=True)
+        self._thread.start()
+
+    def time(self, name, skip_obs=None, **kwargs):
+        return self.chrono.time(name, skip_obs, **kwargs)
+
+    def stage(self, name, skip_obs=None):
+        return self.chrono.stage(name, skip_obs)
+
+    def flush(self):
+        """ send the observations made since the last flush """
+        stages = {}
+
+        for name, stream in list(self.chrono.chronos.items()):
+            delta = stream.pop_state_dict()
+
+            if delta is not None:
+                stages[name] = delta
+
+        if not stages:
+            return
+
+        for message in _pack(self.node, self.seq, stages):
+            try:
+                self.socket.sendto(message, self.address)
+                self.sent += 1
+            except OSError:
+                # collector not running (Unix socket) or network down, drop the delta
+                pass
+
+        self.seq += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception('could not send the stage deltas')
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Collector:
+    """
+        Receive the stage deltas of many `CollectorClient` (processes or nodes)
+        and merge them into a single `MultiStageChrono`
+    """
+
+    def __init__(self, address: Address = ('0.0.0.0', 9876), name=None):
+        self.address = address
+        self.chrono = MultiStageChrono(0, name=name)
+        self.nodes: Dict[str, float] = {}
+        self.received = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.socket = _make_socket(address)
+        self.socket.bind(address)
+        self.socket.settimeout(0.1)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def handle(self, data: bytes):
+        message = json.loads(data.decode('utf-8'))
+        deltas = [(name, StatStream.from_dict(delta)) for name, delta in message['stages'].items()]
+
+        with self.lock:
+            self.received += 1
+            self.nodes[message['node']] = time.time()
+
+            for name, delta in deltas:
+                stream = self.chrono.chronos.get(name)
+
+                if stream is None:
+                    self.chrono.chronos[name] = delta
+                else:
+                    stream.merge(delta)
+
+    def serve_forever(self):
+        while not self._stop.is_set():
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+
+            try:
+                self.handle(data)
+            except (ValueError, LookupError, TypeError, AttributeError, OverflowError):
+                # garbage sent to a public port should not kill the collector
+                self.dropped += 1
+                log.warning('dropped a malformed datagram (%d bytes)', len(data), exc_info=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='benchutils-collector', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self.socket.close()
+        if isinstance(self.address, str):
+            os.unlink(self.address)
+
+    def report(self, *args, **kwargs):
+        with self.lock:
+            return self.chrono.report(*args, **kwargs)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+# valid looking delta, the demo corrupts one field at a time
+_GARBAGE = StatStream(0).state_dict()
+
+
+def _demo_client(address, i):
+    with CollectorClient(address, interval=0.05, node='client-{}'.format(i), skip_obs=5, sketch=True) as client:
+        for _ in range(200):
+            with client.time('sleep'):
+                time.sleep(0.001 * (i + 1))
+
+            with client.time('sum'):
+                sum(range(10000))
+
+
+def _demo(address) -> bool:
+    """ run a collector and 4 clients on localhost, check that every observation was merged """
+    import multiprocessing
+
+    with Collector(address) as collector:
+        # garbage must be dropped without stopping the collector
+        with _make_socket(address) as sock:
+            sock.sendto(b'not json', address)
+            sock.sendto(b'{"node": "x"}', address)
+            sock.sendto(_pack('x', 0, {'sleep': dict(_GARBAGE, sketch={'999999': 1})})[0], address)
+            sock.sendto(_pack('x', 0, {'sleep': dict(_GARBAGE, drop_obs=10 ** 30)})[0], address)
+
+        workers = [multiprocessing.Process(target=_demo_client, args=(address, i)) for i in range(4)]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        time.sleep(0.2)
+        print('{} messages from {} nodes, {} dropped'.format(collector.received, len(collector.nodes),
+                                                            collector.dropped))
+        collector.report()
+
+        expected = 4 * (200 - 5)
+        counts = {name: stream.count for name, stream in collector.chrono.chronos.items()}
+        ok = collector.dropped == 4 and counts == {'sleep': expected, 'sum': expected}
+
+        if not ok:
+            print('expected {} observations per stage, got {}'.format(expected, counts))
+        return ok
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser('Collect and merge the StatStream deltas sent by CollectorClient')
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9876)
+    parser.add_argument('--unix', type=str, default=None, help='listen on a Unix datagram socket instead')
+    parser.add_argument('--interval', type=float, default=10, help='print the report every interval seconds')
+    parser.add_argument('--report', type=str, default=None, help='file to store the final report in')
+    parser.add_argument('--demo', action='store_true', help='check a collector and a few clients on localhost')
+    args = parser.parse_args()
+
+    address = args.unix or (args.host, args.port)
+
+    if args.demo:
+        sys.exit(0 if _demo(args.unix or ('127.0.0.1', args.port)) else 1)
+    else:
+        with Collector(address) as collector:
+            try:
+                while True:
+                    time.sleep(args.interval)
+                    collector.report()
+            except KeyboardInterrupt:
+                pass
+
+            collector.report(file_name=args.report)
@@ -0,0 +1,221 @@
+import os
+import json
+import numpy as np
+
+from typing import Dict, List, Any
+
+
+_MISSING = (None, '', 'NA', 'NaN', 'nan')
+
+
+def _is_missing(value) -> bool:
+    if isinstance(value, (float, np.floating)):
+        return bool(np.isnan(value))
+    return isinstance(value, (str, type(None))) and value in _MISSING
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (bool, int, float, np.integer, np.floating))
+
+
+def _infer_dtype(values: List[Any], backfill=False) -> str:
+    """ int64 only if every value is an integer and nothing is missing, float64 if numbers (NaN for missing) """
+    present = [v for v in values if not _is_missing(v)]
+
+    if present and all(isinstance(v, (bool, int, np.integer)) for v in present):
+        return 'float64' if backfill or len(present) != len(values) else 'int64'
+
+    if all(_is_number(v) for v in present):
+        return 'float64'
+
+    return 'str'
+
+
+class ColumnStore:
+    """
+        Append only columnar store, one raw binary file per column inside the `path` directory.
+
+        String columns are dictionary encoded (int32 codes), the dictionaries, the types and the number of rows
+        are kept inside `schema.json`. Appending only writes at the end of every column file and the whole store
+        is loaded back as numpy arrays with `load_columns(path)`.
+
+        `schema.json` is replaced atomically and is the only source of truth: the bytes past `rows` left by
+        a failed append are truncated by the next one.
+
+        Numeric columns store missing values ('NA', None, '') as NaN, int64 columns are widened to float64
+        when they receive a missing or a non integer value.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        self.schema = {'rows': 0, 'runs': 0, 'columns': {}}
+        schema_file = os.path.join(path, 'schema.json')
+
+        if os.path.exists(schema_file):
+            with open(schema_file, 'r') as file:
+                self.schema = json.load(file)
+
+    @property
+    def rows(self) -> int:
+        return self.schema['rows']
+
+    def _column_file(self, name: str, schema: Dict = None) -> str:
+        column = (schema or self.schema)['columns'].get(name, {})
+        return os.path.join(self.path, column.get('file', '{}.bin'.format(name)))
+
+    @staticmethod
+    def _itemsize(column: Dict) -> int:
+        return np.dtype(np.int32 if column['dtype'] == 'str' else column['dtype']).itemsize
+
+    @staticmethod
+    def _encode(name: str, column: Dict, values: List[Any]) -> np.ndarray:
+        """ encode the values of a column, the dictionary of string columns is extended in place """
+        if column['dtype'] != 'str':
+            for v in values:
+                if not _is_missing(v) and not _is_number(v):
+                    raise ValueError('column {} is numeric, got {!r}'.format(name, v))
+
+            values = [float('nan') if _is_missing(v) else v for v in values]
+            return np.asarray(values, dtype=column['dtype'])
+
+        dictionary = column['dictionary']
+        index = {v: i for i, v in enumerate(dictionary)}
+        codes = []
+        for v in values:
+            v = '' if v is None else str(v)
+            code = index.get(v)
+
+            if code is None:
+                code = index[v] = len(dictionary)
+                dictionary.append(v)
+
+            codes.append(code)
+
+        return np.asarray(codes, dtype=np.int32)
+
+    def append(self, columns: Dict[str, List[Any]]):
+        """
+            append rows, every column must have the same number of values; missing columns are backfilled.
+            Every column is encoded before anything is written, a bad value leaves the store untouched
+        """
+        sizes = {len(values) for values in columns.values()}
+        if len(sizes) != 1:
+            raise ValueError('columns have different lengths {}'.format(sizes))
+
+        n = sizes.pop()
+        schema = json.loads(json.dumps(self.schema))
+        widened = set()
+        new = set()
+
+        for name, values in columns.items():
+            column = schema['columns'].get(name)
+
+            if column is None:
+                dtype = _infer_dtype(values, backfill=self.rows > 0)
+                column = schema['columns'][name] = {'dtype': dtype}
+                if dtype == 'str':
+                    column['dictionary'] = []
+                new.add(name)
+
+            elif column['dtype'] == 'int64' and _infer_dtype(values) == 'float64':
+                column['dtype'] = 'float64'
+                widened.add(name)
+
+        data = {}
+        for name, column in schema['columns'].items():
+            values = columns.get(name, [None] * n)
+
+            if name in new and self.rows > 0:
+                values = [None] * self.rows + list(values)
+
+            if column['dtype'] == 'int64' and any(_is_missing(v) for v in values):
+                column['dtype'] = 'float64'
+                widened.add(name)
+
+            data[name] = values
+
+        encoded = {name: self._encode(name, schema['columns'][name], values) for name, values in data.items()}
+
+        # the int64 file stays valid until the schema is saved, widened columns are rewritten to a new file
+        replaced = []
+        for name in widened - new:
+            old = np.fromfile(self._column_file(name), dtype=np.int64, count=self.rows)
+            encoded[name] = np.concatenate((old.astype(np.float64), encoded[name]))
+            replaced.append(self._column_file(name))
+            schema['columns'][name]['file'] = '{}.bin.float64'.format(name)
+
+        for name, array in encoded.items():
+            if name in new or name in widened:
+                with open(self._column_file(name, schema), 'wb') as file:
+                    file.write(array.tobytes())
+                continue
+
+            # drop the bytes written by an append that failed before saving its schema
+            with open(self._column_file(name, schema), 'r+b') as file:
+                file.truncate(self.rows * self._itemsize(schema['columns'][name]))
+                file.seek(0, os.SEEK_END)
+                file.write(array.tobytes())
+
+        schema['rows'] += n
+        self.schema = schema
+        self._save_schema()
+
+        for file_name in replaced:
+            os.remove(file_name)
+
+    def append_chrono(self, chrono, common: Dict[str, Any] = None) -> int:
+        """ append the statistics of every stage of a MultiStageChrono as one run, return the run id """
+        table = chrono.make_table(list((common or {}).values()))
+        header = chrono.columns() + list((common or {}).keys())
+
+        columns = {name: [row[i] for row in table] for i, name in enumerate(header)}
+        run = self.schema['runs']
+        columns['run'] = [run] * len(table)
+
+        if table:
+            self.schema['runs'] += 1
+            try:
+                self.append(columns)
+            except Exception:
+                self.schema['runs'] -= 1
+                raise
+        else:
+            self.schema['runs'] += 1
+            self._save_schema()
+        return run
+
+    def _save_schema(self):
+        schema_file = os.path.join(self.path, 'schema.json')
+
+        with open(schema_file + '.tmp', 'w') as file:
+            json.dump(self.schema, file)
+
+        os.replace(schema_file + '.tmp', schema_file)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        data = {}
+
+        for name, column in self.schema['columns'].items():
+            dtype = np.int32 if column['dtype'] == 'str' else column['dtype']
+            values = np.fromfile(self._column_file(name), dtype=dtype, count=self.rows)
+
+            if column['dtype'] == 'str':
+                values = np.asarray(column['dictionary'], dtype=object)[values]
+
+            data[name] = values
+
+        return data
+
+
+def load_columns(path: str) -> Dict[str, np.ndarray]:
+    """ load a ColumnStore as a dictionary of numpy arrays """
+    return ColumnStore(path).load()
+
+
+if __name__ == '__main__':
+    import sys
+
+    for key, val in load_columns(sys.argv[1]).items():
+        print('{:>30}: {}'.format(key, val))
@@ -0,0 +1,164 @@
+import math
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from benchutils.chrono import MultiStageChrono, registered_chronos
+from benchutils.statstream import _avg, _var
+
+
+OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+
+_GAUGES = [
+    ('avg', 'average time of the stage'),
+    ('sd', 'standard deviation of the stage time'),
+    ('min', 'fastest observation of the stage'),
+    ('max', 'slowest observation of the stage'),
+    ('last', 'last observation of the stage'),
+]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _chrono_label(chrono: MultiStageChrono) -> str:
+    return chrono.name if chrono.name is not None else 'chrono_{:x}'.format(id(chrono))
+
+
+def render(chronos: List[MultiStageChrono] = None, openmetrics=True, prefix='benchutils_stage') -> str:
+    """
+        OpenMetrics (or Prometheus text format if `openmetrics` is False) exposition of the stages of `chronos`,
+        every `MultiStageChrono` of the process by default.
+
+        The streams are read with `StatStream.peek`, the timed code is never blocked by a scrape.
+    """
+    if chronos is None:
+        chronos = registered_chronos()
+
+    summary = ['# TYPE {}_seconds summary'.format(prefix)]
+    if openmetrics:
+        summary.append('# UNIT {}_seconds seconds'.format(prefix))
+    summary.append('# HELP {}_seconds time spent in the stage'.format(prefix))
+
+    gauges = {}
+    for name, help in _GAUGES:
+        family = '{}_{}_seconds'.format(prefix, name)
+        gauges[name] = ['# TYPE {} gauge'.format(family)]
+        if openmetrics:
+            gauges[name].append('# UNIT {} seconds'.format(family))
+        gauges[name].append('# HELP {} {}'.format(family, help))
+
+    for chrono in chronos:
+        if chrono.disabled:
+            continue
+
+        for stage, stream in list(chrono.chronos.items()):
+            struct = stream.peek()
+            labels = 'chrono="{}",stage="{}"'.format(_escape(_chrono_label(chrono)), _escape(stage))
+            count = max(struct.current_count - struct.drop_obs, 0)
+
+            if count > 0:
+                quantiles = stream.percentiles(struct)
+                for q, value in zip(stream.quantiles, quantiles):
+                    summary.append('{}_seconds{{{},quantile="{}"}} {}'.format(prefix, labels, q, _number(value)))
+
+                values = {
+                    'avg': _avg(struct),
+                    'sd': math.sqrt(max(_var(struct), 0)),
+                    'min': struct.min,
+                    'max': struct.max,
+                    'last': struct.current_obs + struct.first_obs,
+                }
+                for name, _ in _GAUGES:
+                    gauges[name].append('{}_{}_seconds{{{}}} {}'.format(prefix, name, labels, _number(values[name])))
+
+            total = struct.sum + struct.first_obs * count
+            summary.append('{}_seconds_count{{{}}} {}'.format(prefix, labels, count))
+            summary.append('{}_seconds_sum{{{}}} {}'.format(prefix, labels, _number(total)))
+
+    lines = summary
+    for name, _ in _GAUGES:
+        lines.extend(gauges[name])
+
+    if openmetrics:
+        lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    chronos = None
+
+    def do_GET(self):
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = render(self.chronos, openmetrics).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS if openmetrics else PROMETHEUS)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """
+        HTTP endpoint serving the live statistics of every `MultiStageChrono` of the process (or of `chronos`)
+        in the OpenMetrics/Prometheus text format, from a background thread.
+    """
+
+    def __init__(self, port=9100, addr='0.0.0.0', chronos: List[MultiStageChrono] = None):
+        handler = type('MetricsHandler', (_MetricsHandler,), {'chronos': chronos})
+        self.server = ThreadingHTTPServer((addr, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='benchutils-metrics', daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+def start_http_server(port=9100, addr='0.0.0.0', chronos: List[MultiStageChrono] = None) -> MetricsServer:
+    """ serve the stage statistics on http://addr:port/metrics """
+    return MetricsServer(port, addr, chronos)
+
+
+if __name__ == '__main__':
+    import time
+    import urllib.request
+
+    chrono = MultiStageChrono(0, name='demo', sketch=True)
+
+    with start_http_server(0, '127.0.0.1') as server:
+        for i in range(100):
+            with chrono.time('sleep'):
+                time.sleep(0.001)
+
+        request = urllib.request.Request('http://127.0.0.1:{}/metrics'.format(server.port),
+                                         headers={'Accept': 'application/openmetrics-text'})
+        print(urllib.request.urlopen(request).read().decode('utf-8'))
@@ -0,0 +1,133 @@
+import os
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from benchutils.chrono import MultiStageChrono
+from benchutils.runner import BenchRunner
+from benchutils.statstream import StatStream
+
+
+def available_cores() -> List[int]:
+    """ cores this process is allowed to run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def _pin_worker(cores):
+    # every worker takes a different core from the queue
+    core = cores.get()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+
+
+def _run_case(name: str, fun: Callable, args, kwargs, runner_kwargs) -> Tuple[str, Dict, int]:
+    runner = BenchRunner(**runner_kwargs)
+    stream = runner.run_case(name, fun, args, kwargs)
+    return name, stream.state_dict(), runner.numbers[name]
+
+
+class ParallelExecutor:
+    """
+        Run independent benchmark cases in a process pool, every worker being pinned to its own core.
+
+        The first `reserve` cores are left free (OS, interrupts, this process) to reduce the noise from
+        neighbours. Every case is run by a `BenchRunner` inside a worker and sent back as a `StatStream.state_dict`,
+        the results are merged into a single `MultiStageChrono`.
+
+        The cases and their arguments must be picklable.
+        With a `store` (ResultStore) the fingerprints are checked and the results saved by this process,
+        only the cases that changed are sent to the workers (see `BenchRunner.run_case`).
+    """
+
+    def __init__(self, workers=None, reserve=0, cores: List[int] = None, chrono: MultiStageChrono = None,
+                 report=None, store=None, force=False, **runner_kwargs):
+        cores = cores if cores is not None else available_cores()
+        cores = cores[reserve:]
+
+        if not cores:
+            raise ValueError('no core left after reserving {}'.format(reserve))
+
+        self.cores = cores[:workers] if workers is not None else cores
+        self.report_path = report
+        self.runner_kwargs = runner_kwargs
+        self.chrono = chrono or MultiStageChrono(runner_kwargs.get('skip_obs', 0))
+        # looks up and saves the cases of the store, the workers never see it (sqlite connections do not pickle)
+        self.runner = BenchRunner(chrono=self.chrono, store=store, force=force, **runner_kwargs)
+        self.numbers: Dict[str, int] = {}
+        self.pending = []
+
+        queue = multiprocessing.Queue()
+        for core in self.cores:
+            queue.put(core)
+
+        self.pool = ProcessPoolExecutor(len(self.cores), initializer=_pin_worker, initargs=(queue,))
+
+    @property
+    def workers(self) -> int:
+        return len(self.cores)
+
+    @property
+    def reused(self) -> List[str]:
+        """ cases whose stored results were reused """
+        return self.runner.reused
+
+    def submit(self, name: str, fun: Callable, *args, **kwargs):
+        """ schedule the benchmark of `fun(*args, **kwargs)` in the stage `name` """
+        fp, state = self.runner.lookup(name, fun, args, kwargs)
+
+        if state is not None:
+            self.reused.append(name)
+            self._add(name, StatStream.from_dict(state))
+            return
+
+        self.pending.append((fp, self.pool.submit(_run_case, name, fun, args, kwargs, self.runner_kwargs)))
+
+    def _add(self, name: str, stream: StatStream):
+        if name in self.chrono.chronos:
+            self.chrono.chronos[name].merge(stream)
+        else:
+            self.chrono.chronos[name] = stream
+
+    def wait(self) -> MultiStageChrono:
+        """ wait for every scheduled case and merge their results """
+        pending, self.pending = self.pending, []
+
+        for fp, future in pending:
+            name, state, number = future.result()
+            stream = StatStream.from_dict(state)
+
+            self.runner.save(name, fp, stream)
+            self._add(name, stream)
+            self.numbers[name] = number
+
+        return self.chrono
+
+    def report(self, common: Dict[str, str] = None, skip_header=True, **kwargs):
+        """ print the results and append them to the `report` file if any """
+        self.wait()
+        self.chrono.report_csv(file_name=self.report_path, common=dict(common or {}), skip_header=skip_header,
+                               **kwargs)
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    with ParallelExecutor(repeat=20, number=1000) as executor:
+        for n in (10, 100, 1000, 10000):
+            executor.submit('sum_{}'.format(n), sum, range(n))
+            executor.submit('sorted_{}'.format(n), sorted, list(range(n, 0, -1)))
+
+        executor.report()
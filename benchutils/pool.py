@@ -0,0 +1,232 @@
+import math
+
+from multiprocessing import Lock
+from multiprocessing.shared_memory import SharedMemory
+from ctypes import sizeof, c_int64
+from typing import Dict, List
+
+from benchutils.shm import attach_shared_memory
+from benchutils.statstream import StatStream, StatStreamStruct, _update, _update_many, _empty_struct, _merge
+
+
+class _PoolSlot:
+    """ struct-like view on the `index`-th element of every field array of the pool """
+    __slots__ = ('arrays', 'index')
+
+    def __init__(self, arrays, index):
+        self.arrays = arrays
+        self.index = index
+
+
+def _make_field(name):
+    def getter(self):
+        return self.arrays[name][self.index]
+
+    def setter(self, value):
+        self.arrays[name][self.index] = value
+
+    return property(getter, setter)
+
+
+for _name, _ in StatStreamStruct._fields_:
+    setattr(_PoolSlot, _name, _make_field(_name))
+
+
+class PooledStatStream(StatStream):
+    """
+        StatStream view into a `StatStreamPool`, it does not own any memory or lock.
+        Shards and quantile sketches are not supported for pooled streams.
+    """
+
+    def __init__(self, pool: 'StatStreamPool', index: int):
+        self.pool = pool
+        self.index = index
+        self.struct = _PoolSlot(pool.arrays, index)
+        self.shards = None
+        self.sketch = None
+        self.quantiles = ()
+        self.warmup = None
+
+    def __getstate__(self):
+        return self.pool, self.index
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def _copy(self):
+        struct = StatStreamStruct()
+        for name, _ in StatStreamStruct._fields_:
+            setattr(struct, name, getattr(self.struct, name))
+        return struct
+
+    def snapshot(self):
+        with self.pool.lock:
+            return self._copy()
+
+    def peek(self):
+        return self._copy()
+
+    def merge(self, other: StatStream):
+        state = other.snapshot()
+
+        with self.pool.lock:
+            merged = _merge([self._copy(), state], self.struct.drop_obs, self.struct)
+
+            for name, _ in StatStreamStruct._fields_:
+                setattr(self.struct, name, getattr(merged, name))
+
+        return self
+
+    def update(self, val, weight=1):
+        with self.pool.lock:
+            _update(self.struct, val, weight)
+
+    def update_many(self, values, weights=None):
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+
+        if weights is None:
+            weights = np.ones_like(values)
+        else:
+            weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+
+        with self.pool.lock:
+            _update_many(self.struct, values, weights)
+
+
+class _NoLock:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class StatStreamPool:
+    """
+        Store the fields of `capacity` StatStreams as contiguous arrays inside a single shared memory segment.
+
+        Streams allocated by the pool are lightweight views (`PooledStatStream`) sharing a single lock
+        (`lock=False` removes it entirely, each stream must then be updated by a single thread/process at a time).
+        The statistics of every stream can be computed in one vectorized pass with `to_arrays` (requires numpy).
+
+        Streams must be allocated in the parent process before forking for the children to see them.
+    """
+
+    def __init__(self, capacity=1024, lock=True, name=None, create=True):
+        self.capacity = capacity
+        self.lock = Lock() if lock else _NoLock()
+        self.names: Dict[str, int] = {}
+
+        self.offsets = {}
+        offset = sizeof(c_int64)  # allocated stream count
+        for field, ctype in StatStreamStruct._fields_:
+            self.offsets[field] = offset
+            # keep every array 8 bytes aligned
+            offset += int(math.ceil(sizeof(ctype) * capacity / 8) * 8)
+
+        if create:
+            self.shm = SharedMemory(name=name, create=True, size=offset)
+        else:
+            self.shm = attach_shared_memory(name)
+
+        self.allocated = c_int64.from_buffer(self.shm.buf, 0)
+        self.arrays = {
+            field: (ctype * capacity).from_buffer(self.shm.buf, self.offsets[field])
+            for field, ctype in StatStreamStruct._fields_
+        }
+
+    def __getstate__(self):
+        return self.capacity, self.lock, self.names, self.shm.name
+
+    def __setstate__(self, state):
+        capacity, lock, names, name = state
+        self.__init__(capacity, name=name, create=False)
+        self.lock = lock
+        self.names = names
+
+    def __len__(self):
+        return self.allocated.value
+
+    def stream(self, drop_first_obs=10, name=None) -> PooledStatStream:
+        """ allocate a new stream, if a `name` is given the same stream is returned for the same name """
+        if not isinstance(drop_first_obs, int):
+            # the views are recreated and shared between processes, a warmup detector could not follow them
+            raise ValueError('pooled streams need a fixed number of observations to drop, got {!r}'.format(
+                drop_first_obs))
+
+        if name is not None and name in self.names:
+            return PooledStatStream(self, self.names[name])
+
+        with self.lock:
+            index = self.allocated.value
+            if index >= self.capacity:
+                raise MemoryError('StatStreamPool is full ({} streams)'.format(self.capacity))
+
+            self.allocated.value = index + 1
+
+        stream = PooledStatStream(self, index)
+        _empty_struct(drop_first_obs, stream.struct)
+
+        if name is not None:
+            self.names[name] = index
+
+        return stream
+
+    def to_arrays(self) -> Dict[str, 'np.ndarray']:
+        """ compute avg, sd, min, max and count for every allocated streams at once """
+        import numpy as np
+
+        n = len(self)
+        with self.lock:
+            fields = {field: np.ctypeslib.as_array(array)[:n].copy() for field, array in self.arrays.items()}
+
+        count = np.maximum(fields['current_count'] - fields['drop_obs'], 1).astype(np.float64)
+        avg = fields['sum'] / count
+
+        return {
+            'avg': avg + fields['first_obs'],
+            'sd': np.sqrt(fields['sum_sqr'] / count - avg * avg),
+            'min': fields['min'],
+            'max': fields['max'],
+            'count': count.astype(np.int64),
+        }
+
+    def to_table(self, names: List[str] = None, transform=None) -> List[List]:
+        """ rows matching `StatStream.to_array` for the named streams """
+        stats = self.to_arrays()
+
+        if names is None:
+            names = list(self.names.keys())
+
+        table = []
+        for name in names:
+            i = self.names[name]
+            avg, sd, low, high = stats['avg'][i], stats['sd'][i], stats['min'][i], stats['max'][i]
+            count = int(stats['count'][i])
+
+            if transform is not None:
+                table.append([name, transform(avg), 'NA', transform(low), transform(high), count])
+            else:
+                table.append([name, float(avg), float(sd), float(low), float(high), count])
+
+        return table
+
+    def close(self):
+        # release the views before closing the segment, the pooled streams share this dictionary
+        self.arrays.clear()
+        self.allocated = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        self.unlink()
@@ -1,5 +1,6 @@
 from typing import *
 import os.path
+import sys
 from benchutils.statstream import StatStream
 
 
@@ -73,35 +74,18 @@ class PrintTable:
             self.print_fun(str + end, end='')
 
     def print(self, header=True, mode='csv'):
-        impl = {
-            'csv': self.csv_print,
-            'md': self.markdown_print
-        }
-
-        return impl[mode](header)
+        writer = TableWriter(self.columns, mode=mode, col_size=self.col_size, format=self.format)
 
-    def csv_print(self, header):
-        def simple(rowd_id, col_id, val):
-            end = ','
-            if col_id == len(self.col_size) - 1:
-                end = ''
+        if header:
+            self.print_fun(writer.format_header(), end='')
 
-            self.aligned_print(' ' + self.format_cell(val) + ' ', self.col_size[col_id], 'right', end=end)
+        self.print_fun(writer.format_rows(self.data), end='')
 
-        self.foreach(simple, header, beg_row=None, end_row=lambda x: self.print_fun(), after_header=None)
+    def csv_print(self, header):
+        return self.print(header, 'csv')
 
     def markdown_print(self, header):
-        def simple(rowd_id, col_id, val):
-            self.aligned_print(' ' + self.format_cell(val) + ' ', self.col_size[col_id], 'right', end='|')
-
-        def md_header_separator():
-            cols = ['-' * (int(size) - 1) + ':' for size in self.col_size]
-
-            self.print_fun('|' + '|'.join(cols) + '|')
-
-        self.foreach(simple, header,
-                     beg_row=lambda x: self.print_fun('|', end=''),
-                     end_row=lambda x: self.print_fun(), after_header=md_header_separator)
+        return self.print(header, 'md')
 
     def foreach(self, fun, header, beg_row=None, end_row=None, after_header=None):
         if header:
@@ -128,25 +112,123 @@ class PrintTable:
                 end_row(row_id)
 
 
+class TableWriter:
+    """
+        Streaming csv/markdown table writer
+
+        Rows are formatted as a whole and written to the `files` (open handles) in chunks of `buffer_size` characters.
+        The column sizes are computed over the header and a `sample` of rows so the full table never needs to be
+        in memory; rows can be written incrementally while a run is in progress (call `flush` to see them).
+        Cells wider than their column are not truncated, they only misalign their row.
+    """
+
+    def __init__(self, cols, files=(), mode='csv', sample=(), buffer_size=65536, col_size=None, format=None):
+        self.format = format or {
+            float: '.4f',
+            int: '4d'
+        }
+        self.columns = cols
+        self.col_num = len(cols)
+        self.files = list(files)
+        self.mode = mode
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        self.row_count = 0
+
+        self.col_size = col_size
+        if col_size is None:
+            self.col_size = self.compute_col_size(sample)
+
+    def format_cell(self, value: Any) -> str:
+        fmt = self.format.get(type(value))
+        if fmt is not None:
+            return ('{:' + fmt + '}').format(value)
+        return str(value)
+
+    def compute_col_size(self, sample):
+        col_sizes = [len(self.format_cell(val)) + 2 for val in self.columns]
+
+        for row in sample:
+            for col_id, val in enumerate(row):
+                col_sizes[col_id] = max(col_sizes[col_id], len(self.format_cell(val)) + 2)
+
+        return col_sizes
+
+    def format_row(self, row) -> str:
+        if len(row) != self.col_num:
+            raise UnEvenTable('Row ({}) has not the correct number of columns {} != {}'
+                              .format(self.row_count, len(row), self.col_num))
+
+        cells = [(' ' + self.format_cell(val) + ' ').rjust(size) for val, size in zip(row, self.col_size)]
+
+        if self.mode == 'md':
+            return '|' + '|'.join(cells) + '|\n'
+        return ','.join(cells) + '\n'
+
+    def format_rows(self, rows) -> str:
+        return ''.join([self.format_row(row) for row in rows])
+
+    def format_header(self) -> str:
+        header = self.format_row(self.columns)
+
+        if self.mode == 'md':
+            cols = ['-' * (int(size) - 1) + ':' for size in self.col_size]
+            header += '|' + '|'.join(cols) + '|\n'
+
+        return header
+
+    def write(self, text: str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write_header(self):
+        self.write(self.format_header())
+
+    def write_row(self, row):
+        self.write(self.format_row(row))
+        self.row_count += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+
+        for file in self.files:
+            file.write(text)
+            file.flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def print_table(cols, data, filename=None, skip_header=True):
     report = PrintTable(cols, data)
-    report.print()
+    writer = TableWriter(cols, col_size=report.col_size, format=report.format)
+
+    header = writer.format_header()
+    body = writer.format_rows(data)
+    sys.stdout.write(header + body)
 
     if filename is not None:
         if skip_header:
-            header = not os.path.exists(filename)
-        else:
-            header = True
-
-        append_file = open(filename, 'a')
-
-        def new_print(self='', *args, sep=' ', end='\n', file=None):
-            print(self, *args, sep=sep, end=end, file=append_file)
-
-        report.print_fun = new_print
-        report.print(header)
+            header = header if not os.path.exists(filename) else ''
 
-        append_file.close()
+        with open(filename, 'a') as append_file:
+            append_file.write(header + body)
 
 
 def print_stat_streams(names: List[str], stats: List[StatStream], additional_names=[], additional_cols=[], file_name: str=None, skip_header=True):
@@ -0,0 +1,76 @@
+import os
+import time
+import tracemalloc
+
+from typing import Tuple
+
+try:
+    import resource
+
+    # per thread usage is Linux only, fallback to the usage of the whole process
+    _WHO = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+except ImportError:
+    resource = None
+
+
+# name of the metrics returned by `usage_delta`
+RESOURCE_METRICS = ('cpu_thread', 'cpu_user', 'cpu_sys', 'ctx_voluntary', 'ctx_involuntary')
+
+Usage = Tuple[int, float, float, int, int]
+
+
+def resource_usage() -> Usage:
+    """
+        thread CPU time (ns), user and system CPU time (s), voluntary and involuntary context switches
+        of the current thread (~1us)
+    """
+    if resource is None:
+        return time.thread_time_ns(), 0.0, 0.0, 0, 0
+
+    usage = resource.getrusage(_WHO)
+    return time.thread_time_ns(), usage.ru_utime, usage.ru_stime, usage.ru_nvcsw, usage.ru_nivcsw
+
+
+def usage_delta(start: Usage, end: Usage) -> Tuple[float, float, float, int, int]:
+    """ resources used in between two `resource_usage` calls, times in seconds """
+    return (
+        (end[0] - start[0]) * 1e-9,
+        end[1] - start[1],
+        end[2] - start[2],
+        end[3] - start[3],
+        end[4] - start[4])
+
+
+MEMORY_MODES = ('tracemalloc', 'rss')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss() -> int:
+    """ resident set size of the process in bytes (Linux) """
+    with open('/proc/self/statm', 'rb') as file:
+        return int(file.read().split()[1]) * _PAGE_SIZE
+
+
+def memory_usage(mode: str) -> int:
+    """ bytes currently allocated by python (`tracemalloc`) or resident (`rss`) """
+    if mode == 'tracemalloc':
+        return tracemalloc.get_traced_memory()[0]
+    return rss()
+
+
+def check_memory_mode(mode) -> str:
+    """ validate the memory mode, start tracemalloc if necessary """
+    if mode is True:
+        mode = 'tracemalloc'
+
+    if mode not in MEMORY_MODES:
+        raise ValueError('memory should be one of {}, got {}'.format(MEMORY_MODES, mode))
+
+    if mode == 'rss' and not os.path.exists('/proc/self/statm'):
+        raise ValueError('rss is only available on Linux')
+
+    if mode == 'tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    return mode
@@ -1,26 +1,33 @@
-import torch
-import array
+import math
+import bisect
+import numpy as np
+
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+from benchutils.shm import attach_shared_memory
+
+
+def to_numpy_dtype(dtype) -> np.dtype:
+    """
+        Convert numpy dtypes, `array` typecodes ('f', 'd', 'q', ...), dtype names ('float32')
+        and torch dtypes (without importing torch) to a numpy dtype
+    """
+    if type(dtype).__module__.startswith('torch'):
+        # torch.float16 -> float16
+        dtype = str(dtype).split('.')[-1]
+
+    return np.dtype(dtype)
 
 
 class RingBuffer:
-    types = {
-        torch.float16: 'f',  # 4
-        torch.float32: 'f',  # 4
-        torch.float64: 'd',  # 8
-
-        torch.int8:  'b',    # 1
-        torch.int16: 'h',    # 2
-        torch.int32: 'l',    # 4
-        torch.int64: 'q',    # 8
-
-        torch.uint8:  'B',   # 1
-        # torch.uint16: 'H',   # 2
-        # torch.uint32: 'L',   # 4
-        # torch.uint64: 'Q',   # 8
-    }
+    """
+        Fixed size buffer keeping the last `size` observations inside a preallocated numpy array
+    """
 
     def __init__(self, size, dtype, default_val=0):
-        self.array = array.array(self.types[dtype], [default_val] * size)
+        self.array = np.full(size, default_val, dtype=to_numpy_dtype(dtype))
         self.capacity = size
         self.offset = 0
 
@@ -34,12 +41,43 @@ class RingBuffer:
         self.array[self.offset % self.capacity] = item
         self.offset += 1
 
-    def to_list(self):
+    def extend(self, items):
+        """ append many observations at once, only the last `capacity` are written """
+        items = np.asarray(items, dtype=self.array.dtype).ravel()
+        n = len(items)
+        offset = self.offset
+
+        if n >= self.capacity:
+            offset += n - self.capacity
+            items = items[n - self.capacity:]
+            n = self.capacity
+
+        start = offset % self.capacity
+        first = min(n, self.capacity - start)
+
+        self.array[start:start + first] = items[:first]
+        self.array[:n - first] = items[first:]
+
+        # the offset is only published once the data is written (see SharedRingBuffer)
+        self.offset = offset + n
+
+    def view(self) -> Tuple[np.ndarray, ...]:
+        """ in-order views (no copy) of the observations, the oldest observations are in the first view """
         if self.offset < self.capacity:
-            return list(self.array[:self.offset])
-        else:
-            end_idx = self.offset % self.capacity
-            return list(self.array[end_idx: self.capacity]) + list(self.array[0:end_idx])
+            return self.array[:self.offset],
+
+        end_idx = self.offset % self.capacity
+        if end_idx == 0:
+            return self.array,
+
+        return self.array[end_idx:], self.array[:end_idx]
+
+    def to_numpy(self) -> np.ndarray:
+        """ in-order copy of the observations """
+        return np.concatenate(self.view())
+
+    def to_list(self):
+        return self.to_numpy().tolist()
 
     def __len__(self):
         return min(self.capacity, self.offset)
@@ -59,11 +97,231 @@ class RingBuffer:
     @classmethod
     def from_list(cls, lst, size, dtype, default_val=0):
         self = cls(size, dtype, default_val)
-        for item in lst:
-            self.append(item)
+        self.extend(lst)
         return self
 
 
+class WindowedRingBuffer(RingBuffer):
+    """
+        RingBuffer keeping the statistics of the last `size` observations up to date as they are appended
+
+            * avg/sd: incremental sums (shifted by the first observation like StatStream), O(1)
+            * min/max: monotonic deques, amortized O(1)
+            * percentiles: sorted copy of the window, O(log n) search + O(n) memmove per append; the memmove
+              is a C loop, faster than any pure python O(log n) structure for windows up to ~1M observations
+
+        The sums are recomputed from scratch every `capacity` appends to get rid of the floating point drift.
+        It exposes `avg`, `sd` and `val` so it can be used by `show_eta` in place of a StatStream.
+    """
+
+    def __init__(self, size, dtype='float64', default_val=0):
+        super(WindowedRingBuffer, self).__init__(size, dtype, default_val)
+        self.shift = 0
+        self.sum = 0
+        self.sum_sqr = 0
+        self.mins = deque()
+        self.maxs = deque()
+        self.sorted = []
+
+    def append(self, item):
+        # round to the buffer dtype so the value removed later from the sorted window is the same
+        item = float(self.array.dtype.type(item))
+
+        if self.offset == 0:
+            self.shift = item
+
+        if self.offset >= self.capacity:
+            old = float(self.array[self.offset % self.capacity])
+            self.sum -= old - self.shift
+            self.sum_sqr -= (old - self.shift) ** 2
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+
+        super(WindowedRingBuffer, self).append(item)
+
+        obs = item - self.shift
+        self.sum += obs
+        self.sum_sqr += obs * obs
+        bisect.insort(self.sorted, item)
+
+        # drop the observations that left the window or that can never be the min/max again
+        oldest = self.offset - self.capacity
+        while self.mins and (self.mins[-1][1] >= item):
+            self.mins.pop()
+        while self.maxs and (self.maxs[-1][1] <= item):
+            self.maxs.pop()
+
+        self.mins.append((self.offset, item))
+        self.maxs.append((self.offset, item))
+
+        while self.mins[0][0] <= oldest:
+            self.mins.popleft()
+        while self.maxs[0][0] <= oldest:
+            self.maxs.popleft()
+
+        if self.offset % self.capacity == 0:
+            self._recompute()
+
+    def extend(self, items):
+        for item in np.asarray(items).ravel():
+            self.append(item)
+
+    def _recompute(self):
+        values = self.to_numpy().astype(np.float64)
+        self.shift = float(values[0])
+        self.sum = float(np.sum(values - self.shift))
+        self.sum_sqr = float(np.sum((values - self.shift) ** 2))
+
+    @property
+    def count(self) -> int:
+        return len(self)
+
+    @property
+    def val(self) -> float:
+        return self.last()
+
+    @property
+    def avg(self) -> float:
+        if self.count == 0:
+            return 0
+        return self.sum / self.count + self.shift
+
+    @property
+    def var(self) -> float:
+        if self.count == 0:
+            return 0
+        avg = self.sum / self.count
+        return max(self.sum_sqr / self.count - avg * avg, 0)
+
+    @property
+    def sd(self) -> float:
+        return math.sqrt(self.var)
+
+    @property
+    def min(self) -> float:
+        return self.mins[0][1] if self.mins else float('+inf')
+
+    @property
+    def max(self) -> float:
+        return self.maxs[0][1] if self.maxs else float('-inf')
+
+    def percentile(self, q: float) -> float:
+        """ nearest rank percentile of the window, q in [0, 1] """
+        if not self.sorted:
+            return float('nan')
+        return self.sorted[int(round(q * (len(self.sorted) - 1)))]
+
+    def to_dict(self):
+        return {
+            'avg': self.avg,
+            'min': self.min,
+            'max': self.max,
+            'sd': self.sd,
+            'count': self.count,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+        }
+
+
+class TornRead(Exception):
+    pass
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+        Single producer / multiple consumers RingBuffer living in a `multiprocessing.shared_memory` segment.
+
+        The header holds two 8 bytes aligned counters (each written in a single store), seqlock style:
+        before writing, the producer publishes the offset it is writing up to; it writes the observations and
+        publishes the new read offset afterwards. Consumers read the offset, copy the observations and read
+        the "writing up to" counter, if the producer was writing (or wrapped) over the copied region the copy is
+        torn and is retried.
+
+        Consumers attach to the buffer using its `name`
+    """
+
+    def __init__(self, size, dtype, default_val=0, name=None, create=True):
+        dtype = to_numpy_dtype(dtype)
+        self.capacity = size
+        self.dtype = dtype
+
+        if create:
+            self.shm = SharedMemory(name=name, create=True, size=16 + size * dtype.itemsize)
+        else:
+            self.shm = attach_shared_memory(name)
+
+        # read offset, writing up to
+        self.header = np.ndarray((2,), dtype=np.uint64, buffer=self.shm.buf)
+        self.array = np.ndarray((size,), dtype=dtype, buffer=self.shm.buf, offset=16)
+
+        if create:
+            self.header[:] = 0
+            self.array[:] = default_val
+
+    @classmethod
+    def attach(cls, name, size, dtype) -> 'SharedRingBuffer':
+        return cls(size, dtype, name=name, create=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def offset(self) -> int:
+        return int(self.header[0])
+
+    @offset.setter
+    def offset(self, value):
+        self.header[0] = value
+
+    def append(self, item):
+        offset = self.offset
+        self.header[1] = offset + 1
+        self.array[offset % self.capacity] = item
+        self.header[0] = offset + 1
+
+    def extend(self, items):
+        items = np.asarray(items, dtype=self.array.dtype).ravel()
+        self.header[1] = self.offset + len(items)
+        super(SharedRingBuffer, self).extend(items)
+
+    def __getstate__(self):
+        return self.capacity, self.dtype, self.shm.name
+
+    def __setstate__(self, state):
+        capacity, dtype, name = state
+        self.__init__(capacity, dtype, name=name, create=False)
+
+    def read(self, n=None, retries=100) -> np.ndarray:
+        """ consistent, in-order copy of the last `n` observations """
+        for _ in range(retries):
+            end = self.offset
+            count = min(n or self.capacity, end, self.capacity)
+            start = end - count
+
+            first = start % self.capacity
+            if first + count <= self.capacity:
+                data = self.array[first:first + count].copy()
+            else:
+                data = np.concatenate((self.array[first:], self.array[:(first + count) % self.capacity]))
+
+            # slots before `writing - capacity` are being (or have been) overwritten
+            if int(self.header[1]) - start <= self.capacity:
+                return data
+
+        raise TornRead('producer kept overwriting the observations being read')
+
+    def to_numpy(self) -> np.ndarray:
+        return self.read()
+
+    def close(self):
+        self.header = None
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
 if __name__ == '__main__':
 
-    print(RingBuffer.from_list([1, 2, 3], 10, torch.float32))
+    print(RingBuffer.from_list([1, 2, 3], 10, 'float32'))
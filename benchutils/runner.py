@@ -0,0 +1,288 @@
+import gc
+import sys
+import types
+import pickle
+import inspect
+import hashlib
+import itertools
+import functools
+import sysconfig
+
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from benchutils.chrono import MultiStageChrono
+from benchutils.statstream import StatStream
+from benchutils.versioning import get_files_version
+
+
+_template = """
+def inner(_it, _timer{bindings}):
+    _t0 = _timer()
+    for _i in _it:
+        _fun({call})
+    {sync}
+    _t1 = _timer()
+    return _t1 - _t0
+"""
+
+
+def make_inner_loop(fun: Callable, args=(), kwargs=None, sync: Callable = None) -> Callable:
+    """
+        Generate an inner loop specialized for `fun` and its arguments (same idea as `timeit`),
+        the arguments are bound as local variables so the loop only pays for the call itself.
+
+        The generated function takes an iterator (`itertools.repeat(None, number)`) and a timer
+        and returns the time spent running `number` calls in seconds
+    """
+    kwargs = kwargs or {}
+
+    names = {'_fun': fun, '_sync': sync}
+    call = []
+
+    for i, arg in enumerate(args):
+        names[f'_a{i}'] = arg
+        call.append(f'_a{i}')
+
+    for i, (key, arg) in enumerate(kwargs.items()):
+        names[f'_k{i}'] = arg
+        call.append(f'{key}=_k{i}')
+
+    bindings = ''.join(f', {name}={name}' for name in names)
+    src = _template.format(
+        bindings=bindings,
+        call=', '.join(call),
+        sync='_sync()' if sync is not None else 'pass')
+
+    local_ns = {}
+    exec(compile(src, '<benchutils-inner>', 'exec'), names, local_ns)
+    return local_ns['inner']
+
+
+def autorange(inner: Callable, target=0.2, timer=perf_counter) -> int:
+    """
+        Find the number of calls so a single observation lasts at least `target` seconds.
+        Same progression as `timeit.Timer.autorange` (1, 2, 5, 10, 20, 50, ...)
+    """
+    i = 1
+    while True:
+        for j in 1, 2, 5:
+            number = i * j
+            if inner(itertools.repeat(None, number), timer) >= target:
+                return number
+        i *= 10
+
+
+def _is_library(file_name: str) -> bool:
+    """ True if the file is part of the standard library or of an installed package """
+    paths = sysconfig.get_paths()
+    prefixes = {paths['stdlib'], paths['platstdlib'], paths['purelib'], paths['platlib']}
+    return any(file_name.startswith(prefix) for prefix in prefixes if prefix)
+
+
+def dependencies(fun: Callable) -> List[str]:
+    """
+        Source files `fun` depends on: the file of its module, of the modules it references in its globals
+        and of the modules of the functions/classes it references. Standard library and installed packages are ignored
+    """
+    while isinstance(fun, functools.partial):
+        fun = fun.func
+
+    fun = inspect.unwrap(getattr(fun, '__func__', fun))
+    modules = {inspect.getmodule(fun)}
+
+    for value in getattr(fun, '__globals__', {}).values():
+        if isinstance(value, types.ModuleType):
+            modules.add(value)
+        elif isinstance(value, (types.FunctionType, type)):
+            modules.add(sys.modules.get(value.__module__))
+
+    files = set()
+    for module in modules:
+        file_name = getattr(module, '__file__', None)
+
+        if file_name is not None and file_name.endswith('.py') and not _is_library(file_name):
+            files.add(file_name)
+
+    return sorted(files)
+
+
+def _hash_arguments(args, kwargs) -> bytes:
+    """ digest of the arguments of a case, pickled when possible, repr otherwise """
+    try:
+        data = pickle.dumps((args, sorted(kwargs.items())), protocol=4)
+    except Exception:
+        data = repr((args, sorted(kwargs.items()))).encode('utf-8')
+
+    return hashlib.sha256(data).digest()
+
+
+def fingerprint(name: str, files: List[str], args=(), kwargs=None, settings: Dict = None) -> str:
+    """
+        combined hash of a case name, the content of the files it depends on, its arguments,
+        the runner `settings` and the python version
+    """
+    sha256 = hashlib.sha256(name.encode('utf-8'))
+    sha256.update(sys.version.encode('utf-8'))
+    sha256.update(_hash_arguments(args, kwargs or {}))
+    sha256.update(repr(sorted((settings or {}).items())).encode('utf-8'))
+
+    for file_name, digest in sorted(get_files_version(files).items()):
+        sha256.update(file_name.encode('utf-8'))
+        sha256.update(digest.encode('utf-8'))
+
+    return sha256.hexdigest()
+
+
+class BenchRunner:
+    """
+        Run callables `repeat` times, each observation being the average time of `number` calls.
+        If `number` is None it is picked using `autorange` so each observation lasts `target` seconds.
+        With `skip_obs='auto'` the warmup observations are dropped until the series is stationary, the observations
+        the detector kept are all counted so a case has at least 2 * `WarmupDetector.window` observations,
+        more than `repeat` if it is small.
+
+        The results of every case are kept inside a `MultiStageChrono` so they can be reported using `report`
+
+        With a `store` (ResultStore) the results of every case are saved alongside the fingerprint of its source
+        files; as long as the fingerprint does not change, the stored results are reused instead of running the
+        case again (unless `force`).
+    """
+
+    def __init__(self, repeat=100, number=None, target=0.2, skip_obs=0, report=None, sync=None,
+                 disable_gc=True, chrono: MultiStageChrono = None, store=None, force=False):
+        self.repeat = repeat
+        self.number = number
+        self.target = target
+        self.skip_obs = skip_obs
+        self.report_path = report
+        self.sync = sync
+        self.disable_gc = disable_gc
+        self.chrono = chrono or MultiStageChrono(skip_obs, sync=sync)
+        self.numbers: Dict[str, int] = {}
+        self.store = store
+        self.force = force
+        self.reused: List[str] = []
+
+    @staticmethod
+    def from_args(args, **kwargs) -> 'BenchRunner':
+        """ create a runner from the arguments defined by `add_bench_args` """
+        number = args.number
+        target = getattr(args, 'target', None)
+
+        if target is not None:
+            number = None
+            kwargs['target'] = target
+
+        kwargs.setdefault('force', getattr(args, 'force', False))
+        return BenchRunner(repeat=args.repeat, number=number, report=args.report, **kwargs)
+
+    def settings(self, fun: Callable) -> Dict:
+        """ everything besides the code and the arguments that changes the results of a case """
+        return {
+            'fun': '{}.{}'.format(getattr(fun, '__module__', None), getattr(fun, '__qualname__', repr(fun))),
+            'repeat': self.repeat,
+            'number': self.number,
+            'target': self.target,
+            'skip_obs': self.skip_obs,
+            'sync': self.sync is not None,
+            'disable_gc': self.disable_gc,
+        }
+
+    def run(self, name: str, fun: Callable, *args, **kwargs) -> StatStream:
+        """ benchmark `fun(*args, **kwargs)` and store the results in the stage `name` """
+        return self.run_case(name, fun, args, kwargs)
+
+    def run_case(self, name: str, fun: Callable, args=(), kwargs=None, deps: List[str] = None) -> StatStream:
+        """
+            benchmark `fun(*args, **kwargs)` and store the results in the stage `name`
+            :param deps: source files the case depends on, detected from `fun` if None.
+                         If no source file is detected (builtins, installed packages) the case is always run
+        """
+        kwargs = kwargs or {}
+        fp, state = self.lookup(name, fun, args, kwargs, deps)
+
+        if state is not None:
+            return self.reuse(name, state)
+
+        stream = self._run(name, fun, args, kwargs)
+        self.save(name, fp, stream)
+        return stream
+
+    def lookup(self, name: str, fun: Callable, args=(), kwargs=None, deps: List[str] = None):
+        """ fingerprint of the case and its stored `state_dict` if it can be reused, (None, None) without store """
+        if self.store is None:
+            return None, None
+
+        files = deps if deps is not None else dependencies(fun)
+        fp = fingerprint(name, files, args, kwargs or {}, self.settings(fun))
+
+        # nothing tells us when the code of the case changes, do not trust the stored results
+        if self.force or (deps is None and not files):
+            return fp, None
+
+        return fp, self.store.load_case(name, fp)
+
+    def reuse(self, name: str, state) -> StatStream:
+        """ use the stored results of a case """
+        stream = StatStream.from_dict(state)
+        self.chrono.chronos[name] = stream
+        self.reused.append(name)
+        return stream
+
+    def save(self, name: str, fp: str, stream: StatStream):
+        if self.store is not None:
+            self.store.save_case(name, fp, stream.state_dict())
+
+    def _run(self, name: str, fun: Callable, args, kwargs) -> StatStream:
+        inner = make_inner_loop(fun, args, kwargs, self.sync)
+        stream = self.chrono.get_stream(name, self.skip_obs)
+
+        gc_enabled = gc.isenabled()
+        if self.disable_gc:
+            gc.disable()
+
+        try:
+            number = self.number
+            if number is None:
+                number = autorange(inner, self.target)
+
+            self.numbers[name] = number
+            it = itertools.repeat
+
+            if stream.warmup is not None:
+                # skip_obs='auto', sample until the series is stationary then keep `repeat` observations
+                while not stream.warmed_up:
+                    stream.update(inner(it(None, number), perf_counter) / number)
+
+                remaining = max(self.repeat - stream.count, 0)
+            else:
+                remaining = self.repeat + self.skip_obs
+
+            for _ in range(remaining):
+                stream.update(inner(it(None, number), perf_counter) / number)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        return stream
+
+    def report(self, common: Dict[str, str] = None, skip_header=True, **kwargs):
+        """ print the results and append them to the `report` file if any """
+        common = dict(common or {})
+        self.chrono.report_csv(file_name=self.report_path, common=common, skip_header=skip_header, **kwargs)
+
+
+def bench(fun: Callable, *args, repeat=100, number=None, target=0.2, **kwargs) -> StatStream:
+    """ benchmark a single callable """
+    return BenchRunner(repeat, number, target).run(fun.__name__, fun, *args, **kwargs)
+
+
+if __name__ == '__main__':
+    from benchutils.arguments import get_arguments
+
+    runner = BenchRunner.from_args(get_arguments())
+
+    runner.run('sum', sum, range(1000))
+    runner.run('sorted', sorted, list(range(1000, 0, -1)), reverse=True)
+    runner.report()
@@ -0,0 +1,30 @@
+import sys
+import threading
+
+from multiprocessing.shared_memory import SharedMemory
+
+_register_lock = threading.Lock()
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+        Open an existing shared memory segment without taking ownership of it.
+
+        Before python 3.13 every process opening a segment registers it with its resource tracker,
+        which unlinks it when the process exits, destroying the segment of the process that created it.
+        Unregistering afterwards is not an option, forked children share the tracker of their parent
+        and would remove the registration of the creator.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+
+    from multiprocessing import resource_tracker
+
+    with _register_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
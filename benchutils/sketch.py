@@ -0,0 +1,133 @@
+import math
+import ctypes
+
+from multiprocessing.sharedctypes import RawArray
+from ctypes import c_double
+from typing import List, Dict
+
+
+QUANTILES = (0.5, 0.95, 0.99, 0.999)
+
+
+def quantile_name(q: float) -> str:
+    """ 0.5 -> p50, 0.999 -> p99.9 """
+    return 'p{:g}'.format(q * 100)
+
+
+class QuantileSketch:
+    """
+        Bounded memory quantile sketch (log-bucketed histogram, similar to DDSketch/HDR histogram)
+
+        Observations are counted in buckets whose bounds grow geometrically, any quantile estimate is within
+        `rel_error` of the true value for observations inside [min_value, max_value].
+        Observations smaller than `min_value` (including negative values) are counted in the first bucket,
+        observations bigger than `max_value` in the last one.
+
+        The counts live in a shared memory array with one row per accumulator (see StatStream shards)
+        merging sketches is only a matter of adding the counts together.
+    """
+
+    def __init__(self, rows=1, rel_error=0.01, min_value=1e-9, max_value=1e6):
+        self.rel_error = rel_error
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + rel_error) / (1 - rel_error)
+        self.log_gamma = math.log(self.gamma)
+        self.size = int(math.ceil(math.log(max_value / min_value) / self.log_gamma)) + 2
+        self.rows = rows
+        self.counts = RawArray(c_double, rows * self.size)
+
+    def index(self, val: float) -> int:
+        if val <= self.min_value:
+            return 0
+
+        return min(int(math.ceil(math.log(val / self.min_value) / self.log_gamma)), self.size - 1)
+
+    def value(self, index: int) -> float:
+        """ representative value of a bucket, the bucket `i` holds (min * gamma ^ (i - 1), min * gamma ^ i] """
+        if index == 0:
+            return self.min_value
+
+        return 2 * self.min_value * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, val: float, weight=1, row=0):
+        self.counts[row * self.size + self.index(val)] += weight
+
+    def add_many(self, values, weights, row=0):
+        """ vectorized `add` for numpy arrays """
+        import numpy as np
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = np.ceil(np.log(values / self.min_value) / self.log_gamma)
+
+        index = np.clip(np.nan_to_num(index, nan=0, neginf=0), 0, self.size - 1).astype(np.int64)
+        index[values <= self.min_value] = 0
+
+        counts = np.frombuffer(self.counts, dtype=np.float64)[row * self.size:(row + 1) * self.size]
+        counts += np.bincount(index, weights=weights, minlength=self.size)
+
+    def merged(self) -> List[float]:
+        """ sum the counts of every rows """
+        size = self.size
+        counts = self.counts[0:size]
+
+        for row in range(1, self.rows):
+            offset = row * size
+            for i, c in enumerate(self.counts[offset:offset + size]):
+                if c:
+                    counts[i] += c
+
+        return counts
+
+    def quantiles(self, qs=QUANTILES, lower=float('-inf'), upper=float('+inf')) -> List[float]:
+        """ estimate the quantiles `qs` (sorted), the estimates are clamped to [lower, upper] (i.e. min & max) """
+        counts = self.merged()
+        total = sum(counts)
+
+        if total == 0:
+            return [float('nan')] * len(qs)
+
+        results = []
+        cumulative = 0
+        bucket = -1
+
+        for q in qs:
+            rank = q * (total - 1)
+
+            while cumulative <= rank and bucket < self.size - 1:
+                bucket += 1
+                cumulative += counts[bucket]
+
+            results.append(min(max(self.value(bucket), lower), upper))
+
+        return results
+
+    def merge(self, other: 'QuantileSketch'):
+        """ both sketches must have been created with the same parameters """
+        self.merge_counts(other.state_dict())
+        return self
+
+    def merge_counts(self, counts: Dict[int, float], row=0):
+        """ add the sparse counts of a `state_dict` to the given row, raise ValueError if a bucket is out of range """
+        checked = []
+        for index, count in counts.items():
+            index = int(index)
+
+            if not 0 <= index < self.size:
+                raise ValueError('bucket {} is out of range [0, {})'.format(index, self.size))
+
+            if not isinstance(count, (int, float)) or isinstance(count, bool) or not 0 <= count < math.inf:
+                raise ValueError('bucket {} has an invalid count {!r}'.format(index, count))
+
+            checked.append((index, count))
+
+        offset = row * self.size
+        for index, count in checked:
+            self.counts[offset + index] += count
+
+    def clear(self):
+        ctypes.memset(self.counts, 0, ctypes.sizeof(self.counts))
+
+    def state_dict(self) -> Dict[int, float]:
+        """ sparse representation of the merged counts """
+        return {i: c for i, c in enumerate(self.merged()) if c}
@@ -1,10 +1,19 @@
+import os
 import math
 import json
+import numbers
+import threading
+import weakref
+
+from typing import List
 
 from multiprocessing import Value
-from multiprocessing.sharedctypes import Value
+from multiprocessing.sharedctypes import Value, RawArray
 from ctypes import Structure, c_double, c_int
 
+from benchutils.sketch import QuantileSketch, QUANTILES, quantile_name
+from benchutils.warmup import WarmupDetector
+
 
 class StatStreamStruct(Structure):
     _fields_ = [
@@ -19,6 +28,166 @@ class StatStreamStruct(Structure):
     ]
 
 
+def _empty_struct(drop_first_obs, struct=None):
+    """ initialize a new (or reset an existing) unsynchronized accumulator """
+    if struct is None:
+        struct = StatStreamStruct()
+
+    struct.sum = 0
+    struct.sum_sqr = 0
+    struct.first_obs = 0
+    struct.min = float('+inf')
+    struct.max = float('-inf')
+    struct.current_count = 0
+    struct.current_obs = 0
+    struct.drop_obs = drop_first_obs
+    return struct
+
+
+def _update(struct, val, weight=1):
+    """ fold a new observation into the accumulator, the caller is responsible for the locking """
+    struct.current_count += weight
+
+    if struct.current_count < struct.drop_obs:
+        struct.current_obs = val
+        return
+
+    if _count(struct) == 1:
+        struct.first_obs = val
+
+    obs = val - struct.first_obs
+    struct.current_obs = obs
+    struct.sum += float(obs) * float(weight)
+    struct.sum_sqr += float(obs * obs) * float(weight)
+
+    struct.min = min(struct.min, val)
+    struct.max = max(struct.max, val)
+
+
+def _update_many(struct, values, weights):
+    """
+        vectorized `_update`, fold the numpy arrays `values` and `weights` into the accumulator
+        return the mask of the observations that are counted
+    """
+    import numpy as np
+
+    cumulative = struct.current_count + np.cumsum(weights)
+    kept = cumulative >= struct.drop_obs
+
+    struct.current_count = int(cumulative[-1])
+    if not kept[-1]:
+        struct.current_obs = float(values[-1])
+        return kept
+
+    # the first observation is reset as long as count == 1, the sum is always 0 at that point
+    reset = kept & (cumulative - struct.drop_obs <= 1)
+    if reset.any():
+        struct.first_obs = float(values[np.flatnonzero(reset)[-1]])
+
+    obs = values[kept & ~reset] - struct.first_obs
+    weight = weights[kept & ~reset]
+    struct.sum += float(np.sum(obs * weight))
+    struct.sum_sqr += float(np.sum(obs * obs * weight))
+    struct.current_obs = float(values[-1]) - struct.first_obs
+
+    struct.min = min(struct.min, float(values[kept].min()))
+    struct.max = max(struct.max, float(values[kept].max()))
+    return cumulative > struct.drop_obs
+
+
+def _merge(structs, drop_obs, current=None):
+    """
+        Exact parallel merge of the accumulators.
+
+        Each accumulator is shifted by its own first observation, the sums are moved to the shift of the first
+        non empty accumulator using
+
+            sum((x - a)^2) = sum((x - b)^2) + 2 (b - a) sum(x - b) + n (b - a)^2
+
+        so no precision is lost compared to a single accumulator.
+        `current` is the accumulator used to compute the last observation (`val`)
+    """
+    out = _empty_struct(drop_obs)
+    count = 0
+
+    for struct in structs:
+        out.min = min(out.min, struct.min)
+        out.max = max(out.max, struct.max)
+
+        n = struct.current_count - struct.drop_obs
+        if n <= 0:
+            continue
+
+        if count == 0:
+            out.first_obs = struct.first_obs
+            out.sum = struct.sum
+            out.sum_sqr = struct.sum_sqr
+        else:
+            shift = struct.first_obs - out.first_obs
+            out.sum_sqr += struct.sum_sqr + 2 * shift * struct.sum + n * shift * shift
+            out.sum += struct.sum + n * shift
+
+        count += n
+
+    if count > 0:
+        out.current_count = count + drop_obs
+    elif structs:
+        out.current_count = structs[0].current_count
+
+    if current is not None:
+        out.current_obs = current.current_obs + current.first_obs - out.first_obs
+
+    return out
+
+
+def _to_dict(struct):
+    return {name: getattr(struct, name) for name, _ in StatStreamStruct._fields_}
+
+
+_INT_MAX = 2 ** 31 - 1
+
+
+def _check_state(data):
+    """ validate a `state_dict` before it is written into the struct, ctypes would silently truncate the counts """
+    for name, ctype in StatStreamStruct._fields_:
+        value = data[name]
+
+        if ctype is c_int:
+            if not isinstance(value, numbers.Integral) or isinstance(value, bool) or not 0 <= value <= _INT_MAX:
+                raise ValueError('{} should be an integer in [0, {}], got {!r}'.format(name, _INT_MAX, value))
+
+        elif not isinstance(value, numbers.Real) or isinstance(value, bool):
+            raise ValueError('{} should be a number, got {!r}'.format(name, value))
+
+
+def _count(struct) -> int:
+    # is count is 0 then self.sum is 0 so everything should workout
+    return max(struct.current_count - struct.drop_obs, 1)
+
+
+def _avg(struct) -> float:
+    return struct.sum / float(_count(struct)) + struct.first_obs
+
+
+def _var(struct) -> float:
+    count = float(_count(struct))
+    avg = struct.sum / count
+    return struct.sum_sqr / count - avg * avg
+
+
+# Sharded streams need to forget the shard of their parent process when forked
+_sharded_streams = weakref.WeakSet()
+
+
+def _reset_local_shards():
+    for stream in list(_sharded_streams):
+        stream._local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_local_shards)
+
+
 class StatStream(object):
     """
         Sharable object
@@ -31,9 +200,35 @@ class StatStream(object):
         In order to make the computation stable we store the first observation and subtract it to every other
         observations. The idea is if x ~ N(mu, sigma)  x - x0 and the sum of x - x0 should be close(r) to 0 allowing
         for greater precision; without that trick `var` was getting negative on some iteration.
+
+        Sharded mode (`shards > 0`)
+
+        Every update of the shared struct has to go through its lock which becomes a bottleneck
+        when many threads/processes update the same stream. In sharded mode each thread (or process) claims
+        its own unsynchronized accumulator in a shared memory array and the accumulators are merged exactly when
+        the statistics are read. The first `drop_first_obs` observations are dropped per shard.
+        If more threads than shards update the stream, the extra threads fall back to the locked shared struct.
+
+        Quantiles (`sketch=True`)
+
+        The observations are also counted in a bounded memory `QuantileSketch` (one row per shard)
+        the `quantiles` (p50, p95, p99, p99.9 by default) are then reported alongside the other statistics.
+
+        Adaptive warmup (`drop_first_obs='auto'`)
+
+        Instead of dropping a fixed number of observations, the observations are dropped until a `WarmupDetector`
+        finds the series stationary, `drop_obs` is then the number of observations that were discarded.
+        The detection is done by the process, a custom detector can be given through `warmup`.
     """
 
-    def __init__(self, drop_first_obs=10):
+    def __init__(self, drop_first_obs=10, shards=0, sketch=False, quantiles=QUANTILES, warmup=None):
+        self.warmup = warmup
+        if drop_first_obs == 'auto':
+            self.warmup = warmup or WarmupDetector()
+
+        if self.warmup is not None:
+            drop_first_obs = 0
+
         self.struct = Value(
             StatStreamStruct,
             0,  # sum
@@ -45,126 +240,348 @@ class StatStream(object):
             0,  # current_obs
             drop_first_obs)  # drop_obs
 
+        self.quantiles = quantiles
+        self.sketch = None
+        self._spare_sketch = None
+        if sketch:
+            self.sketch = QuantileSketch(rows=shards + 1)
+
+        self.shards = None
+        if shards > 0:
+            self.shards = RawArray(StatStreamStruct, shards)
+            for shard in self.shards:
+                _empty_struct(drop_first_obs, shard)
+
+            self.claimed_shards = Value(c_int, 0)
+            self._local = threading.local()
+            _sharded_streams.add(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_local', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shards is not None:
+            self._local = threading.local()
+            _sharded_streams.add(self)
+
+    def _local_shard(self):
+        """ return the accumulator owned by the current thread and its index, None if all the shards are taken """
+        try:
+            return self._local.shard, self._local.row
+        except AttributeError:
+            pass
+
+        with self.claimed_shards.get_lock():
+            idx = self.claimed_shards.value
+            if idx < len(self.shards):
+                self.claimed_shards.value = idx + 1
+
+        shard = None
+        if idx < len(self.shards):
+            shard = self.shards[idx]
+
+        self._local.shard = shard
+        self._local.row = idx + 1
+        return shard, idx + 1
+
+    def snapshot(self):
+        """ return a consistent copy of the state of the stream, merging the shards if necessary """
+        with self.struct.get_lock():
+            shared = StatStreamStruct.from_buffer_copy(self.struct.get_obj())
+
+        return self._merge_shards(shared)
+
+    def peek(self):
+        """
+            `snapshot` without taking the lock, it never blocks the writers but the copy can mix fields
+            from before and after a concurrent update. Good enough for live monitoring (see `benchutils.metrics`)
+        """
+        return self._merge_shards(StatStreamStruct.from_buffer_copy(self.struct.get_obj()))
+
+    def _merge_shards(self, shared):
+        if self.shards is None:
+            return shared
+
+        structs = [shared] + list(self.shards[:self.claimed_shards.value])
+
+        current = getattr(self._local, 'shard', None)
+        if current is None:
+            current = shared
+
+        return _merge(structs, shared.drop_obs, current)
+
+    def merge(self, other: 'StatStream'):
+        """ merge the observations of another stream into this one """
+        state = other.snapshot()
+
+        with self.struct.get_lock():
+            struct = self.struct.get_obj()
+            merged = _merge([struct, state], struct.drop_obs, struct)
+
+            for name, _ in StatStreamStruct._fields_:
+                setattr(struct, name, getattr(merged, name))
+
+            if self.sketch is not None and other.sketch is not None:
+                self.sketch.merge(other.sketch)
+
+        return self
+
     @classmethod
-    def from_dict(cls, data):
-        cls.struct.sum = data['sum']
-        cls.struct.sum_sqr = data['sum_sqr']
-        cls.struct.first_obs = data['first_obs']
-        cls.struct.min = data['min']
-        cls.struct.max = data['max']
-        cls.struct.current_count = data['current_count']
-        cls.struct.current_obs = data['current_obs']
-        cls.struct.drop_obs = data['drop_obs']
-
-        return cls
+    def from_dict(cls, data, **kwargs):
+        """ create a new stream from a `state_dict`, raise ValueError if a field is out of range """
+        _check_state(data)
+        self = cls(data['drop_obs'], sketch='sketch' in data, **kwargs)
+        struct = self.struct.get_obj()
+
+        struct.sum = data['sum']
+        struct.sum_sqr = data['sum_sqr']
+        struct.first_obs = data['first_obs']
+        struct.min = data['min']
+        struct.max = data['max']
+        struct.current_count = data['current_count']
+        struct.current_obs = data['current_obs']
+        struct.drop_obs = data['drop_obs']
+
+        if self.sketch is not None:
+            self.sketch.merge_counts(data['sketch'])
+
+        return self
+
+    def pop_state_dict(self):
+        """
+            `state_dict` of the observations made since the previous call (None if there are none),
+            the stream starts again from empty without dropping any observation. Used to ship deltas
+            (see `benchutils.collector`), the merge of every delta is the state of the whole stream.
+
+            The sketch is double buffered, the new observations go into a cleared spare sketch while the
+            previous one is serialized outside of the lock. The deltas must be taken by the process owning the stream,
+            sharded streams are not supported.
+        """
+        if self.shards is not None:
+            raise ValueError('sharded streams cannot be reset')
+
+        with self.struct.get_lock():
+            struct = self.struct.get_obj()
+            if struct.current_count - struct.drop_obs <= 0:
+                return None
+
+            delta = StatStreamStruct.from_buffer_copy(struct)
+            _empty_struct(0, struct)
+
+            sketch = self.sketch
+            if sketch is not None:
+                self.sketch, self._spare_sketch = self._spare_sketch or QuantileSketch(), None
+
+        data = _to_dict(delta)
+        if sketch is not None:
+            data['sketch'] = sketch.state_dict()
+            sketch.clear()
+            self._spare_sketch = sketch
+
+        return data
 
     def state_dict(self):
-        data = dict()
+        data = _to_dict(self.snapshot())
 
-        data['sum'] = self.struct.sum
-        data['sum_sqr'] = self.struct.sum_sqr
-        data['first_obs'] = self.struct.first_obs
-        data['min'] = self.struct.min
-        data['max'] = self.struct.max
-        data['current_count'] = self.struct.current_count
-        data['current_obs'] = self.struct.current_obs
-        data['drop_obs'] = self.struct.drop_obs
+        if self.sketch is not None:
+            data['sketch'] = self.sketch.state_dict()
 
         return data
 
     @property
     def sum(self):
-        return self.struct.sum
+        return self.snapshot().sum
 
     @property
     def sum_sqr(self):
-        return self.struct.sum_sqr
+        return self.snapshot().sum_sqr
 
     @property
     def current_count(self):
-        return self.struct.current_count
+        return self.snapshot().current_count
 
     @property
     def current_obs(self):
-        return self.struct.current_obs
+        return self.snapshot().current_obs
 
     @property
     def max(self):
-        return self.struct.max
+        return self.snapshot().max
 
     @property
     def min(self):
-        return self.struct.min
+        return self.snapshot().min
 
     @property
     def drop_obs(self):
-        return self.struct.drop_obs
+        return self.snapshot().drop_obs
 
     @property
     def first_obs(self):
-        return self.struct.first_obs
+        return self.snapshot().first_obs
 
     @property
     def total(self):
-        return self.struct.sum + self.first_obs * self.count
+        struct = self.snapshot()
+        return struct.sum + struct.first_obs * _count(struct)
 
     def __iadd__(self, other):
         self.update(other, 1)
         return self
 
+    @property
+    def warmed_up(self) -> bool:
+        """ True once the warmup observations have been dropped """
+        if self.warmup is not None:
+            return self.warmup.done
+        return self.current_count >= self.drop_obs
+
+    def _warmup_update(self, struct, val, weight):
+        """ buffer the observation inside the warmup detector, replay the kept observations once detected """
+        struct.current_count += weight
+        struct.drop_obs = struct.current_count
+        struct.current_obs = val
+
+        if not self.warmup.add(val, weight):
+            return
+
+        struct.drop_obs = self.warmup.discarded
+        struct.current_count = struct.drop_obs
+
+        for obs, w in self.warmup.kept:
+            _update(struct, obs, w)
+
+            if self.sketch is not None and struct.current_count > struct.drop_obs:
+                self.sketch.add(obs, w)
+
     def update(self, val, weight=1):
-        self.struct.current_count += weight
+        if self.warmup is not None and not self.warmup.done:
+            with self.struct.get_lock():
+                if not self.warmup.done:
+                    return self._warmup_update(self.struct.get_obj(), val, weight)
+
+        if self.shards is not None:
+            shard, row = self._local_shard()
+
+            if shard is not None:
+                _update(shard, val, weight)
+
+                if self.sketch is not None and shard.current_count > shard.drop_obs:
+                    self.sketch.add(val, weight, row)
+                return
+
+        with self.struct.get_lock():
+            struct = self.struct.get_obj()
+            _update(struct, val, weight)
+
+            if self.sketch is not None and struct.current_count > struct.drop_obs:
+                self.sketch.add(val, weight)
+
+    def update_many(self, values, weights=None):
+        """ fold a whole array of observations into the stream in a single vectorized pass (requires numpy) """
+        import numpy as np
 
-        if self.current_count < self.drop_obs:
-            self.struct.current_obs = val
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
             return
 
-        if self.count == 1:
-            self.struct.first_obs = val
+        if weights is None:
+            weights = np.ones_like(values)
+        else:
+            weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
 
-        self.struct.current_obs = val - self.first_obs
-        self.struct.sum += float(self.current_obs) * float(weight)
-        self.struct.sum_sqr += float(self.current_obs * self.current_obs) * float(weight)
+        if self.warmup is not None and not self.warmup.done:
+            # the detector looks at the observations one by one until the series is stationary
+            i = 0
+            while i < values.size and not self.warmup.done:
+                self.update(float(values[i]), int(weights[i]))
+                i += 1
 
-        self.struct.min = min(self.min, val)
-        self.struct.max = max(self.max, val)
+            values, weights = values[i:], weights[i:]
+            if values.size == 0:
+                return
+
+        if self.shards is not None:
+            shard, row = self._local_shard()
+
+            if shard is not None:
+                counted = _update_many(shard, values, weights)
+
+                if self.sketch is not None:
+                    self.sketch.add_many(values[counted], weights[counted], row)
+                return
+
+        with self.struct.get_lock():
+            counted = _update_many(self.struct.get_obj(), values, weights)
+
+            if self.sketch is not None:
+                self.sketch.add_many(values[counted], weights[counted])
 
     @property
     def val(self) -> float:
-        return self.current_obs + self.first_obs
+        struct = self.snapshot()
+        return struct.current_obs + struct.first_obs
 
     @property
     def count(self) -> int:
-        # is count is 0 then self.sum is 0 so everything should workout
-        return max(self.current_count - self.drop_obs, 1)
+        return _count(self.snapshot())
 
     @property
     def avg(self) -> float:
-        return self.sum / float(self.count) + self.first_obs
+        return _avg(self.snapshot())
 
     @property
     def var(self) -> float:
-        avg = self.sum / float(self.count)
-        return self.sum_sqr / float(self.count) - avg * avg
+        return _var(self.snapshot())
 
     @property
     def sd(self) -> float:
         return math.sqrt(self.var)
 
+    def percentiles(self, struct=None) -> List[float]:
+        """ estimated value of each `quantiles`, empty if the stream does not keep a sketch """
+        if self.sketch is None:
+            return []
+
+        if struct is None:
+            struct = self.snapshot()
+        return self.sketch.quantiles(self.quantiles, struct.min, struct.max)
+
+    def columns(self) -> List[str]:
+        """ name of the columns returned by `to_array` """
+        return ['Average', 'Deviation', 'Min', 'Max', 'count'] + self.quantile_names()
+
+    def quantile_names(self) -> List[str]:
+        if self.sketch is None:
+            return []
+        return [quantile_name(q) for q in self.quantiles]
+
     def to_array(self, transform=None):
+        struct = self.snapshot()
+        percentiles = self.percentiles(struct)
+
         if transform is not None:
-            return [transform(self.avg), 'NA', transform(self.min), transform(self.max), self.count]
-        return [self.avg, self.sd, self.min, self.max, self.count]
+            return [transform(_avg(struct)), 'NA', transform(struct.min), transform(struct.max), _count(struct)] + \
+                [transform(p) for p in percentiles]
+        return [_avg(struct), math.sqrt(_var(struct)), struct.min, struct.max, _count(struct)] + percentiles
 
     def to_dict(self):
+        struct = self.snapshot()
         data = {
-            'avg': self.avg,
-            'min': self.min,
-            'max': self.max,
-            'sd': self.sd,
-            'count': self.count,
+            'avg': _avg(struct),
+            'min': struct.min,
+            'max': struct.max,
+            'sd': math.sqrt(_var(struct)),
+            'count': _count(struct),
             'unit': 's'
         }
+        data.update(zip(self.quantile_names(), self.percentiles(struct)))
+
+        if self.warmup is not None:
+            data['warmup'] = self.warmup.discarded
         return data
 
     def to_json(self):
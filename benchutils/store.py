@@ -0,0 +1,153 @@
+import json
+import time
+import sqlite3
+
+from datetime import datetime
+from typing import Dict, List, Tuple, Any, Optional
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT,
+    commit_hash TEXT,
+    commit_date TEXT,
+    commit_ts   REAL,
+    file_hash   TEXT,
+    created     REAL,
+    common      TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_commit ON runs (commit_ts, commit_hash);
+CREATE INDEX IF NOT EXISTS runs_hash ON runs (commit_hash, file_hash);
+
+CREATE TABLE IF NOT EXISTS stats (
+    stage   TEXT,
+    metric  TEXT,
+    run_id  INTEGER,
+    value   REAL,
+    PRIMARY KEY (stage, metric, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS stats_run ON stats (run_id);
+
+CREATE TABLE IF NOT EXISTS cases (
+    name        TEXT,
+    fingerprint TEXT,
+    created     REAL,
+    state       TEXT,
+    PRIMARY KEY (name, fingerprint)
+);
+"""
+
+
+class ResultStore:
+    """
+        Embedded (SQLite) store of MultiStageChrono runs keyed by git commit and file hash.
+
+        Every statistic of every stage is stored as a (stage, metric, run) row, the primary key makes
+        queries like "p95 of stage X over the last 200 commits" index lookups instead of scanning past reports.
+    """
+
+    def __init__(self, path='benchutils.db'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_schema)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, chrono, commit_hash: str = None, commit_date: datetime = None, file_hash: str = None,
+               common: Dict[str, Any] = None) -> int:
+        """ store every stage statistics of `chrono`, return the run id """
+        commit_ts = commit_date.timestamp() if commit_date is not None else None
+        commit_date = commit_date.isoformat() if commit_date is not None else None
+
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (name, commit_hash, commit_date, commit_ts, file_hash, created, common) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (chrono.name, commit_hash, commit_date, commit_ts, file_hash, time.time(), json.dumps(common or {})))
+
+            run_id = cursor.lastrowid
+
+            rows = []
+            for stage, stream in chrono.chronos.items():
+                for metric, value in stream.to_dict().items():
+                    if isinstance(value, (int, float)):
+                        rows.append((stage, metric, run_id, value))
+
+            self.db.executemany('INSERT INTO stats (stage, metric, run_id, value) VALUES (?, ?, ?, ?)', rows)
+
+        return run_id
+
+    def record_run(self, chrono, module=None, file_name: str = None, common: Dict[str, Any] = None) -> int:
+        """ record a run versioned by the git commit of `module` and the hash of `file_name` """
+        from benchutils.versioning import get_git_version, get_file_version
+
+        commit_hash, commit_date = None, None
+        if module is not None:
+            commit_hash, commit_date = get_git_version(module)
+
+        file_hash = None
+        if file_name is not None:
+            file_hash = get_file_version(file_name)
+
+        return self.record(chrono, commit_hash, commit_date, file_hash, common)
+
+    def stage_history(self, stage: str, metric='avg', last=200) -> List[Tuple[str, str, float]]:
+        """ (commit hash, commit date, value) of a stage metric over the `last` commits, oldest first """
+        return self.db.execute("""
+            SELECT runs.commit_hash, runs.commit_date, stats.value
+            FROM stats JOIN runs ON runs.id = stats.run_id
+            WHERE stats.stage = ? AND stats.metric = ? AND runs.commit_hash IN (
+                SELECT commit_hash FROM runs
+                GROUP BY commit_hash
+                ORDER BY MAX(commit_ts) DESC
+                LIMIT ?
+            )
+            ORDER BY runs.commit_ts, runs.id
+        """, (stage, metric, last)).fetchall()
+
+    def runs(self, commit_hash: str = None, file_hash: str = None) -> List[Tuple]:
+        """ (id, name, commit hash, commit date, file hash, common) of the matching runs """
+        query = 'SELECT id, name, commit_hash, commit_date, file_hash, common FROM runs WHERE 1 = 1'
+        params = []
+
+        if commit_hash is not None:
+            query += ' AND commit_hash = ?'
+            params.append(commit_hash)
+
+        if file_hash is not None:
+            query += ' AND file_hash = ?'
+            params.append(file_hash)
+
+        return self.db.execute(query + ' ORDER BY id', params).fetchall()
+
+    def run_stats(self, run_id: int) -> Dict[str, Dict[str, float]]:
+        """ statistics of every stage of a run """
+        stats = {}
+        for stage, metric, value in self.db.execute(
+                'SELECT stage, metric, value FROM stats WHERE run_id = ?', (run_id,)):
+            stats.setdefault(stage, {})[metric] = value
+
+        return stats
+
+    def save_case(self, name: str, fingerprint: str, state: Dict[str, Any]):
+        """ store the `StatStream.state_dict` of a benchmark case for its code fingerprint """
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO cases (name, fingerprint, created, state) VALUES (?, ?, ?, ?)',
+                            (name, fingerprint, time.time(), json.dumps(state)))
+
+    def load_case(self, name: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """ `StatStream.state_dict` of a previous run of the case with the same fingerprint, if any """
+        row = self.db.execute('SELECT state FROM cases WHERE name = ? AND fingerprint = ?',
+                              (name, fingerprint)).fetchone()
+
+        if row is None:
+            return None
+        return json.loads(row[0])
@@ -0,0 +1,171 @@
+import os
+import json
+import mmap
+import struct
+import itertools
+import threading
+
+from typing import Dict, List, Tuple
+
+from benchutils.chrono import MultiStageChrono
+
+
+MAGIC = b'BUTRACE1'
+HEADER = struct.Struct('<8sQQQ')    # magic, capacity, pid, record count
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 8 + 8 + 8
+RECORD = struct.Struct('<IIqq')     # stage id, thread id, start (ns), duration (ns)
+
+
+class TraceLog:
+    """
+        Fixed size, memory mapped log of every observation (stage id, thread id, start ns, duration ns).
+
+        The records are packed directly inside the mapped file, no python object is kept per event.
+        When the log is full the oldest records are overwritten (ring buffer).
+        The stage names are appended next to the log (`<file_name>.names`, one json `[name, id]` per line) as soon
+        as they are first seen, a crashed process leaves a readable log.
+
+        Use `python -m benchutils.trace <file_name>` to convert the log to a Chrome/Perfetto trace
+    """
+
+    def __init__(self, file_name: str, capacity=1000000):
+        self.file_name = file_name
+        self.capacity = capacity
+        self.names: Dict[str, int] = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.count_lock = threading.Lock()
+        self.published = 0
+
+        size = HEADER.size + RECORD.size * capacity
+        with open(file_name, 'wb') as file:
+            file.truncate(size)
+
+        self.file = open(file_name, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.mm, 0, MAGIC, capacity, os.getpid(), 0)
+        self.names_file = open(file_name + '.names', 'w')
+
+    def stage_id(self, name: str) -> int:
+        idx = self.names.get(name)
+
+        if idx is None:
+            with self.lock:
+                idx = self.names.get(name)
+
+                if idx is None:
+                    idx = self.names[name] = len(self.names)
+                    # written (to the OS) before the first record using it
+                    self.names_file.write(json.dumps([name, idx]) + '\n')
+                    self.names_file.flush()
+
+        return idx
+
+    def record(self, stage_id: int, start: int, duration: int):
+        # next() on itertools.count is atomic with the GIL, threads never write in the same slot
+        i = next(self.counter)
+        RECORD.pack_into(self.mm, HEADER.size + (i % self.capacity) * RECORD.size,
+                         stage_id, threading.get_native_id(), start, duration)
+
+        # threads can finish their record out of order, the count must never go backwards
+        with self.count_lock:
+            if i + 1 > self.published:
+                self.published = i + 1
+                COUNT.pack_into(self.mm, COUNT_OFFSET, i + 1)
+
+    def flush(self):
+        self.names_file.flush()
+        self.mm.flush()
+
+    def close(self):
+        if self.mm.closed:
+            return
+
+        self.flush()
+        self.mm.close()
+        self.file.close()
+        self.names_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_trace(file_name: str) -> Tuple[int, List[str], List[Tuple[int, int, int, int]]]:
+    """ return the pid, the stage names and the records of a trace log in chronological order """
+    with open(file_name + '.names', 'r') as file:
+        # the last line might be truncated if the process crashed while writing it
+        names = []
+        for line in file:
+            try:
+                names.append(json.loads(line))
+            except ValueError:
+                break
+
+    stages = [None] * len(names)
+    for name, idx in names:
+        stages[idx] = name
+
+    with open(file_name, 'rb') as file:
+        data = file.read()
+
+    magic, capacity, pid, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('{} is not a benchutils trace'.format(file_name))
+
+    records = list(RECORD.iter_unpack(memoryview(data)[HEADER.size:]))
+    if count > capacity:
+        start = count % capacity
+        records = records[start:] + records[:start]
+    else:
+        records = records[:count]
+
+    return pid, stages, records
+
+
+def to_chrome(file_name: str) -> Dict:
+    """ convert a trace log to the Chrome/Perfetto trace event format """
+    pid, stages, records = read_trace(file_name)
+
+    events = []
+    for stage, tid, start, duration in records:
+        events.append({
+            'name': stages[stage],
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': duration / 1000,
+            'pid': pid,
+            'tid': tid
+        })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ns'}
+
+
+def aggregate(file_name: str, skip_obs=0, **kwargs) -> MultiStageChrono:
+    """ recompute the statistics of every stage from a trace log """
+    _, stages, records = read_trace(file_name)
+    chrono = MultiStageChrono(skip_obs, **kwargs)
+
+    for stage, _, _, duration in records:
+        chrono.get_stream(stages[stage]).update(duration * 1e-9)
+
+    return chrono
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser('Convert a benchutils trace log')
+    parser.add_argument('trace', type=str, help='trace log to convert')
+    parser.add_argument('--chrome', type=str, default=None, help='file to save the Chrome/Perfetto trace in')
+    parser.add_argument('--report', type=str, default=None, help='file to store the aggregated statistics in')
+    args = parser.parse_args()
+
+    if args.chrome is not None:
+        with open(args.chrome, 'w') as out:
+            json.dump(to_chrome(args.trace), out)
+
+    aggregate(args.trace).report(file_name=args.report)
@@ -1,12 +1,112 @@
-import git
+import os
+import mmap
+import json
+import zlib
 import hashlib
+import tempfile
+import functools
 
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Tuple, Dict, Iterable, Optional
 
 
-def get_git_version(module) -> Tuple[str, str]:
-    """ This suppose that you did a dev installation of the `module` and that a .git folder is present """
-    repo = git.Repo(path=module.__file__, search_parent_directories=True)
+def _read_git_file(git_file: str) -> str:
+    """ submodules and worktrees have a `.git` file pointing to their git directory """
+    with open(git_file, 'r') as file:
+        content = file.read().strip()
+
+    if not content.startswith('gitdir:'):
+        raise LookupError('{} is not a git file'.format(git_file))
+
+    return os.path.normpath(os.path.join(os.path.dirname(git_file), content[7:].strip()))
+
+
+def _common_dir(git_dir: str) -> str:
+    """ the directory holding the objects and the shared refs (differs from `git_dir` for worktrees) """
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r') as file:
+            return os.path.normpath(os.path.join(git_dir, file.read().strip()))
+    except OSError:
+        return git_dir
+
+
+def _find_git_dir(path: str) -> Optional[str]:
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        path = os.path.dirname(path)
+
+    while True:
+        git_dir = os.path.join(path, '.git')
+        if os.path.isdir(git_dir):
+            return git_dir
+
+        if os.path.isfile(git_dir):
+            return _read_git_file(git_dir)
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _resolve_head(git_dir: str) -> str:
+    with open(os.path.join(git_dir, 'HEAD'), 'r') as file:
+        head = file.read().strip()
+
+    if not head.startswith('ref:'):
+        return head
+
+    ref = head[4:].strip()
+    common_dir = _common_dir(git_dir)
+
+    for ref_file in (os.path.join(git_dir, ref), os.path.join(common_dir, ref)):
+        if os.path.exists(ref_file):
+            with open(ref_file, 'r') as file:
+                return file.read().strip()
+
+    with open(os.path.join(common_dir, 'packed-refs'), 'r') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+
+    raise LookupError('could not resolve {}'.format(ref))
+
+
+def _read_commit_date(git_dir: str, sha: str) -> datetime:
+    """ parse the committer date of a loose commit object, packed objects raise FileNotFoundError """
+    with open(os.path.join(_common_dir(git_dir), 'objects', sha[:2], sha[2:]), 'rb') as file:
+        data = zlib.decompress(file.read())
+
+    for line in data.split(b'\n'):
+        if line.startswith(b'committer '):
+            timestamp, offset = line.rsplit(b' ', 2)[1:]
+            sign = -1 if offset.startswith(b'-') else 1
+            offset = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])) * sign
+            return datetime.fromtimestamp(int(timestamp), timezone(offset))
+
+    raise LookupError('commit {} has no committer'.format(sha))
+
+
+@functools.lru_cache(maxsize=None)
+def _git_version(path: str) -> Tuple[str, datetime]:
+    # fast path, read .git directly
+    try:
+        git_dir = _find_git_dir(path)
+    except (OSError, LookupError):
+        git_dir = None
+
+    if git_dir is not None:
+        try:
+            sha = _resolve_head(git_dir)
+            return sha[:20], _read_commit_date(git_dir, sha)
+        except (OSError, LookupError, ValueError, zlib.error):
+            pass
+
+    import git
+
+    repo = git.Repo(path=path, search_parent_directories=True)
 
     commit_hash = repo.git.rev_parse(repo.head.object.hexsha, short=20)
     commit_date = repo.head.object.committed_datetime
@@ -14,29 +114,103 @@ def get_git_version(module) -> Tuple[str, str]:
     return commit_hash, commit_date
 
 
-BUF_SIZE = 65536
+def get_git_version(module) -> Tuple[str, str]:
+    """
+        This suppose that you did a dev installation of the `module` and that a .git folder is present.
+        The result is memoized, `.git` is read directly and GitPython is only used when that fails
+        (packed commit objects, worktrees, ...)
+    """
+    return _git_version(os.path.dirname(os.path.abspath(module.__file__)))
 
 
-def get_file_version(file_name: str) -> str:
-    """ hash the file using sha256, used in combination with get_git_version to version non committed modifications """
+def _hash_file(file_name: str) -> str:
+    """ sha256 of a file, mmap'd so hashlib can process it in one call without holding the GIL """
     sha256 = hashlib.sha256()
 
     with open(file_name, 'rb') as f:
-        while True:
-            data = f.read(BUF_SIZE)
-
-            if not data:
-                break
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha256.hexdigest()
 
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
             sha256.update(data)
 
     return sha256.hexdigest()
 
 
+def get_file_version(file_name: str) -> str:
+    """ hash the file using sha256, used in combination with get_git_version to version non committed modifications """
+    return _hash_file(file_name)
+
+
+def default_cache_file() -> str:
+    cache_dir = os.environ.get('BENCHUTILS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'benchutils'))
+    return os.path.join(cache_dir, 'file_hashes.json')
+
+
+def _cache_key(file_name: str) -> Tuple[str, str]:
+    path = os.path.abspath(file_name)
+    stat = os.stat(path)
+    return path, '{}:{}:{}'.format(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def get_files_version(file_names: Iterable[str], cache_file: Optional[str] = '', workers: int = None) -> Dict[str, str]:
+    """
+        Hash many files in parallel (thread pool, hashlib releases the GIL)
+
+        The hashes are cached on disk keyed by (path, size, mtime_ns, inode), only new or modified files are hashed.
+        `cache_file=''` uses `default_cache_file()`, `None` disables the on-disk cache.
+    """
+    if cache_file == '':
+        cache_file = default_cache_file()
+
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            cache = {}
+
+    versions = {}
+    missing = []
+
+    for file_name in file_names:
+        path, key = _cache_key(file_name)
+        entry = cache.get(path)
+
+        if entry is not None and entry[0] == key:
+            versions[file_name] = entry[1]
+        else:
+            missing.append((file_name, path, key))
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(_hash_file, [path for _, path, _ in missing])
+
+            for (file_name, path, key), digest in zip(missing, hashes):
+                versions[file_name] = digest
+                cache[path] = (key, digest)
+
+        if cache_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+
+            # concurrent processes must not share the temporary file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as file:
+                    json.dump(cache, file)
+
+                os.replace(tmp, cache_file)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    return versions
+
+
 if __name__ == '__main__':
     print(type(get_file_version(__file__)))
 
     import benchutils
 
     print(get_git_version(benchutils))
-
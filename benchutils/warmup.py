@@ -0,0 +1,176 @@
+import math
+import statistics
+
+
+class WarmupDetector:
+    """
+        Detect when a series of observations becomes stationary.
+
+        The observations are buffered (at most `max_obs`) and summarized by the median of every `batch` observations
+        so a few outliers (GC, interrupts) do not look like a change of level. Every `window` observations the end of
+        the warmup is estimated with MSER (Marginal Standard Error Rule) over the batch medians: the truncation point
+        minimizing the standard error of the mean of the batches left after it. The series is considered
+        stationary when
+
+            * the truncation point is in the first half of the history and keeps at least 2 * `window` observations
+            * the kept batches have no trend: the slope of their linear regression is below `threshold`
+              standard errors or their drift is within `tolerance` (relative) of their mean
+
+        for `confirm` consecutive checks, a slow warmup cannot pass on a single lucky window.
+        After `max_obs` observations the series is considered stationary no matter what and the MSER truncation
+        point is used.
+    """
+
+    def __init__(self, window=20, threshold=2.0, tolerance=0.01, max_obs=1000, confirm=2, batch=5):
+        self.window = window
+        self.threshold = threshold
+        self.tolerance = tolerance
+        self.max_obs = max_obs
+        self.confirm = confirm
+        self.batch = batch
+        self.history = []
+        self.batches = []
+        self.start = 0
+        self.passes = 0
+        self.seen = 0
+        self.done = False
+
+    def add(self, val, weight=1) -> bool:
+        """ add a new observation, return True once the series is stationary """
+        if self.done:
+            return True
+
+        self.history.append((val, weight))
+        self.seen += weight
+
+        if len(self.history) % self.batch == 0:
+            self.batches.append(statistics.median(v for v, _ in self.history[-self.batch:]))
+
+        if self.seen >= self.max_obs:
+            self.start = self.truncation() * self.batch
+            self.done = True
+
+        elif len(self.history) >= 2 * self.window and len(self.history) % self.window == 0:
+            self.passes = self.passes + 1 if self.is_stationary() else 0
+            self.done = self.passes >= self.confirm
+
+        return self.done
+
+    @property
+    def kept(self):
+        """ (observation, weight) after the warmup, only meaningful once done """
+        return self.history[self.start:]
+
+    @property
+    def discarded(self) -> int:
+        """ number of observations that were part of the warmup """
+        if not self.done:
+            return self.seen
+        return sum(w for _, w in self.history[:self.start])
+
+    def truncation(self) -> int:
+        """ MSER truncation point, index of the first batch to keep, at least `window` observations are kept """
+        obs = self.batches
+        if not obs:
+            return 0
+
+        minimum = max(self.window // self.batch, 2)
+        shift = obs[-1]
+        s = s2 = 0
+        best, best_stat = 0, None
+
+        # the sums of the kept batches are accumulated from the end
+        for i in range(len(obs) - 1, -1, -1):
+            val = obs[i] - shift
+            s += val
+            s2 += val * val
+
+            kept = len(obs) - i
+            if kept < minimum and i > 0:
+                continue
+
+            stat = (s2 - s * s / kept) / (kept * kept)
+            if best_stat is None or stat <= best_stat:
+                best, best_stat = i, stat
+
+        return best
+
+    def has_trend(self, obs) -> bool:
+        """ linear regression of the values against their index, True if the slope is significant """
+        k = len(obs)
+        t_mean = (k - 1) / 2
+        mean = sum(obs) / k
+
+        sxx = sum((t - t_mean) ** 2 for t in range(k))
+        sxy = sum((t - t_mean) * (v - mean) for t, v in enumerate(obs))
+        if sxx == 0:
+            return False
+
+        slope = sxy / sxx
+        if abs(slope) * k <= self.tolerance * abs(mean):
+            return False
+
+        intercept = mean - slope * t_mean
+        res = sum((v - intercept - slope * t) ** 2 for t, v in enumerate(obs))
+        se = math.sqrt(res / max(k - 2, 1) / sxx)
+        if se == 0:
+            return True
+
+        return abs(slope) / se >= self.threshold
+
+    def is_stationary(self) -> bool:
+        start = self.truncation()
+        n = len(self.batches)
+
+        if start > n // 2 or (n - start) * self.batch < 2 * self.window:
+            return False
+
+        self.start = start * self.batch
+        return not self.has_trend(self.batches[start:])
+
+
+def _check_synthetic(trials=20) -> bool:
+    """ feed synthetic warmups to `StatStream('auto')`, the kept observations must be close to the steady state """
+    import random
+    from benchutils.statstream import StatStream
+
+    series = {
+        # name: (latency at t, max latency at the truncation point, max observations discarded)
+        'flat': (lambda t: 1, 1.01, 100),
+        'spike': (lambda t: 10 if t < 3 else 1, 1.01, 100),
+        'step': (lambda t: 3 if t < 50 else 1, 1.01, 150),
+        'linear': (lambda t: 10 - 9 * t / 300 if t < 300 else 1, 1.2, 1000),
+        'exponential': (lambda t: 1 + 9 * math.exp(-t / 50), 1.2, 1000),
+    }
+
+    ok = True
+    for name, (latency, max_level, max_discarded) in series.items():
+        discarded = []
+
+        for trial in range(trials):
+            rng = random.Random(trial)
+            stream = StatStream('auto')
+
+            t = 0
+            while not stream.warmed_up:
+                # 5% noise and 1% of 3x outliers
+                outlier = 3 if rng.random() < 0.01 else 1
+                stream.update(latency(t) * (1 + rng.gauss(0, 0.05)) * outlier)
+                t += 1
+
+            discarded.append(stream.drop_obs)
+
+        level = max(latency(d) for d in discarded)
+        passed = level <= max_level and max(discarded) <= max_discarded
+        ok = ok and passed
+
+        print('{:>12} discarded {:4d} - {:4d} (median {:4d}) worst level {:.3f} {}'.format(
+            name, min(discarded), max(discarded), sorted(discarded)[trials // 2], level, 'ok' if passed else 'FAIL'))
+
+    return ok
+
+
+if __name__ == '__main__':
+    import sys
+
+    sys.exit(0 if _check_synthetic() else 1)